@@ -0,0 +1,159 @@
+"""
+Check the AI request coordinator against a local fake provider
+
+The fake provider enforces its own requests-per-second limit and answers
+429 with ``Retry-After`` when it is exceeded, and also fails a fraction of
+calls with 429 at random. The run fires bursts of duplicate prompts and
+more load than the limits allow, then checks that
+
+- identical in-flight prompts reached the provider once,
+- the provider never saw more calls in a second than the configured rate plus
+  one second of burst,
+- requests that could not be served within ``--max-wait`` were shed with
+  ``ProviderOverloaded`` rather than queued indefinitely.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_ai_coordinator --rps 20 --requests 400 --duplicates 4
+
+Exits with status 1 if any check fails. ``tests/test_ai_coordinator.py``
+uses the same fake provider.
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from collections import Counter, deque
+from types import SimpleNamespace
+from typing import Deque, List
+
+from services.ai_coordinator import ProviderLimits, ProviderOverloaded, RequestCoordinator, request_key
+
+
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after: float):
+        super().__init__("rate limited")
+        self.response = SimpleNamespace(headers={"retry-after": str(retry_after)})
+
+
+class FakeProvider:
+    """Answers after ``latency`` seconds, returning 429 above ``rps`` calls a second"""
+
+    def __init__(self, rps: float, latency: float, error_rate: float):
+        self.rps = rps
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls: List[float] = []
+        self.prompts: Counter = Counter()
+        self.rejected = 0
+        self._window: Deque[float] = deque()
+
+    async def complete(self, prompt: str, max_tokens: int):
+        now = time.monotonic()
+        self.calls.append(now)
+        while self._window and now - self._window[0] >= 1.0:
+            self._window.popleft()
+        # The provider allows one second of burst on top of its rate
+        if len(self._window) >= 2 * self.rps or random.random() < self.error_rate:
+            self.rejected += 1
+            raise FakeRateLimitError(retry_after=0.5)
+        self._window.append(now)
+        self.prompts[prompt] += 1
+        await asyncio.sleep(self.latency)
+        return {"content": f"reply to {prompt}", "tokens_used": len(prompt) // 4 + max_tokens}
+
+
+def busiest_second(calls: List[float]) -> int:
+    calls = sorted(calls)
+    busiest, start = 0, 0
+    for end, timestamp in enumerate(calls):
+        while timestamp - calls[start] >= 1.0:
+            start += 1
+        busiest = max(busiest, end - start + 1)
+    return busiest
+
+
+async def run(args) -> bool:
+    provider = FakeProvider(args.rps, args.latency, args.error_rate)
+    coordinator = RequestCoordinator({"fake": ProviderLimits(
+        requests_per_minute=args.rps * 60,
+        tokens_per_minute=args.rps * 60 * args.max_tokens * 2,
+        max_concurrency=args.concurrency,
+        max_queue=args.max_queue,
+        max_wait=args.max_wait,
+    )})
+
+    async def request(prompt: str):
+        key = request_key("fake", {"prompt": prompt, "max_tokens": args.max_tokens})
+        started = time.monotonic()
+        try:
+            await coordinator.submit(
+                "fake", key,
+                lambda: provider.complete(prompt, args.max_tokens),
+                estimated_tokens=len(prompt) // 4 + args.max_tokens,
+                tokens_used=lambda result: result["tokens_used"],
+            )
+            return "ok", time.monotonic() - started
+        except ProviderOverloaded:
+            return "shed", time.monotonic() - started
+        except FakeRateLimitError:
+            return "rate_limited", time.monotonic() - started
+
+    # Each prompt is sent --duplicates times at once, like a retrying UI
+    prompts = [f"Can you do better on price for order {i}?" for i in range(args.requests // args.duplicates)]
+    start = time.monotonic()
+    results = await asyncio.gather(*(
+        request(prompt) for prompt in prompts for _ in range(args.duplicates)
+    ))
+    elapsed = time.monotonic() - start
+
+    outcomes = Counter(outcome for outcome, _ in results)
+    shed_latency = max((latency for outcome, latency in results if outcome == "shed"), default=0.0)
+    busiest = busiest_second(provider.calls)
+    repeated = sum(1 for count in provider.prompts.values() if count > 1)
+    stats = coordinator.stats()["fake"]
+
+    print(f"requests: {len(results)} ({len(prompts)} distinct), elapsed {elapsed:.1f}s")
+    print(f"outcomes: {dict(outcomes)}")
+    print(f"provider calls: {len(provider.calls)}, rejected with 429: {provider.rejected}, "
+          f"busiest second: {busiest} (limit {2 * args.rps:.0f})")
+    print(f"coalesced: {stats['coalesced']}, shed: {stats['shed']}, "
+          f"wait p50/p95: {stats['wait_ms_p50']}/{stats['wait_ms_p95']} ms, "
+          f"slowest shed: {shed_latency:.2f}s")
+
+    failures = []
+    if repeated:
+        failures.append(f"{repeated} prompts reached the provider more than once")
+    if busiest > 2 * args.rps:
+        failures.append("provider rate limit exceeded")
+    if shed_latency > args.max_wait + 1.0:
+        failures.append("requests waited past max_wait before being shed")
+    if outcomes["ok"] == 0:
+        failures.append("no request succeeded")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rps", type=float, default=20)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--duplicates", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-queue", type=int, default=100)
+    parser.add_argument("--max-wait", type=float, default=3.0)
+    parser.add_argument("--max-tokens", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
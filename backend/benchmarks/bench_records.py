@@ -0,0 +1,77 @@
+"""
+Measure resident memory and load time per stored conversation: plain dicts vs RecordStore
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_records --records 50000
+"""
+
+import argparse
+import gc
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from benchmarks.bench_serialization import make_conversations
+from models.records import ConversationRecord
+from services import serialization
+from services.storage import RecordStore
+
+
+def measure(load):
+    """Return (resident bytes, seconds); timed without tracemalloc, which slows allocation"""
+
+    gc.collect()
+    start = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - start
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = load()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "conversations.json"
+        path.write_bytes(serialization.dumps(make_conversations(args.records)))
+
+        def plain_dicts():
+            return serialization.read_json(path)
+
+        def store_body():
+            # What list endpoints touch: the resident body, never decoded
+            store = RecordStore(lambda: path, ConversationRecord)
+            store.encoded()
+            return store
+
+        def store_records():
+            # After a write or records(): the body plus the decoded records
+            store = RecordStore(lambda: path, ConversationRecord)
+            store.records()
+            return store
+
+        results = [
+            ("plain dicts", measure(plain_dicts)),
+            ("store, body only", measure(store_body)),
+            ("store, body + records", measure(store_records)),
+        ]
+
+    dict_bytes = results[0][1][0]
+    print(f"records:                {args.records}")
+    for label, (resident, elapsed) in results:
+        print(f"{label + ':':<24}{resident / args.records:.0f} B/record "
+              f"({100 * (resident / dict_bytes - 1):+.0f}%), load {elapsed * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
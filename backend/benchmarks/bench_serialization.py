@@ -0,0 +1,85 @@
+"""
+Benchmark the default FastAPI response path against the fast serializer
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_serialization --records 20000
+"""
+
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+
+from services import serialization
+
+
+def make_conversations(count: int) -> List[Dict[str, Any]]:
+    """Build conversation records shaped like the ones the frontend stores"""
+
+    conversations = []
+    for i in range(count):
+        conversations.append({
+            "id": str(uuid.uuid4()),
+            "title": f"Negotiation {i}",
+            "messages": [
+                {
+                    "role": "user" if turn % 2 == 0 else "assistant",
+                    "content": f"Turn {turn}: can you do a better price on order {i}?",
+                    "timestamp": datetime.now().isoformat(),
+                }
+                for turn in range(6)
+            ],
+            "metadata": {
+                "intent": "discount_request",
+                "outcome": "successful",
+                "final_price": 99.5 + i,
+                "business_type": "retail",
+                "complexity": "medium",
+                "tags": ["price", "bulk"],
+            },
+            "created_at": datetime.now().isoformat(),
+            "is_favorite": i % 7 == 0,
+        })
+    return conversations
+
+
+def best_of(func: Callable[[], Any], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = make_conversations(args.records)
+
+    default_path = best_of(lambda: json.dumps(jsonable_encoder(data)).encode("utf-8"), args.repeat)
+    fast_path = best_of(lambda: serialization.dumps(data), args.repeat)
+
+    pretty_size = len(json.dumps(data, indent=2).encode("utf-8"))
+    compact_size = len(serialization.dumps(data))
+
+    print(f"records:                          {args.records}")
+    print(f"backend:                          {serialization.BACKEND}")
+    print(f"jsonable_encoder + json.dumps:    {default_path * 1000:.1f} ms")
+    print(f"serialization.dumps:              {fast_path * 1000:.1f} ms "
+          f"({default_path / fast_path:.1f}x faster)")
+    print(f"on-disk size, indent=2:           {pretty_size / 1024:.0f} KiB")
+    print(f"on-disk size, compact:            {compact_size / 1024:.0f} KiB "
+          f"({100 * (1 - compact_size / pretty_size):.0f}% smaller)")
+
+
+if __name__ == "__main__":
+    main()
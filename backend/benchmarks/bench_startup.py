@@ -0,0 +1,119 @@
+"""
+Measure backend cold start: import time, RSS and the slowest imports
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_startup --runs 5 --max-seconds 1.5 --max-rss-mb 120
+
+Exits with status 1 when the median import time or the peak RSS is over
+budget, or a heavy library is imported at startup. ``tests/test_startup.py``
+runs the same check.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+MAX_SECONDS = 1.5
+MAX_RSS_MB = 120.0
+
+# Imports main in a fresh interpreter and reports its own import time and RSS
+_CHILD = """
+import json, resource, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+heavy = sorted(m for m in ("openai", "anthropic", "pandas", "sklearn", "sqlalchemy", "numpy")
+               if m in sys.modules)
+print(json.dumps({"seconds": elapsed, "rss_mb": rss_kb / 1024, "heavy": heavy}))
+"""
+
+
+def run_child(env, extra_args=()):
+    return subprocess.run(
+        [sys.executable, *extra_args, "-c", _CHILD],
+        capture_output=True, text=True, env=env, check=True,
+    )
+
+
+def slowest_imports(stderr: str, limit: int):
+    """Parse ``-X importtime`` output into the slowest cumulative imports"""
+
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(cumulative), depth, name.strip()))
+    # Only report top-level imports so nested modules are not counted twice
+    top_level = [row for row in rows if row[1] <= 1]
+    top_level.sort(reverse=True)
+    return top_level[:limit]
+
+
+def measure(runs: int, importtime: bool = False) -> Dict[str, Any]:
+    """Median import time, peak RSS and heavy modules over ``runs`` cold starts"""
+
+    with tempfile.TemporaryDirectory() as home:
+        # Keep the benchmark from creating dataset files in the real home directory
+        env = dict(os.environ, HOME=home, PROFILING_ENABLED="false")
+
+        results = [json.loads(run_child(env).stdout) for _ in range(runs)]
+        stderr = run_child(env, ("-X", "importtime")).stderr if importtime else ""
+
+    return {
+        "seconds": statistics.median(result["seconds"] for result in results),
+        "rss_mb": max(result["rss_mb"] for result in results),
+        "heavy": results[0]["heavy"],
+        "importtime": stderr,
+    }
+
+
+def budget_failures(result: Dict[str, Any], max_seconds: float = MAX_SECONDS,
+                    max_rss_mb: float = MAX_RSS_MB) -> List[str]:
+    failures = []
+    if result["seconds"] > max_seconds:
+        failures.append(f"import time {result['seconds']:.2f}s exceeds budget {max_seconds:.2f}s")
+    if result["rss_mb"] > max_rss_mb:
+        failures.append(f"RSS {result['rss_mb']:.1f} MB exceeds budget {max_rss_mb:.1f} MB")
+    if result["heavy"]:
+        failures.append(f"heavy modules imported at startup: {', '.join(result['heavy'])}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--max-seconds", type=float, default=MAX_SECONDS)
+    parser.add_argument("--max-rss-mb", type=float, default=MAX_RSS_MB)
+    args = parser.parse_args()
+
+    result = measure(args.runs, importtime=True)
+
+    print(f"import main (median of {args.runs}): {result['seconds'] * 1000:.0f} ms")
+    print(f"peak RSS:                      {result['rss_mb']:.1f} MB")
+    print(f"heavy modules loaded:          {', '.join(result['heavy']) or 'none'}")
+    print()
+    print("slowest imports (cumulative):")
+    for cumulative, _, name in slowest_imports(result["importtime"], args.top):
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    failures = budget_failures(result, args.max_seconds, args.max_rss_mb)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Load-check the storage layer under several uvicorn workers
+
+Starts ``uvicorn main:app --workers N`` against a temporary home directory,
+creates, updates and deletes conversations concurrently, then checks that
+every acknowledged write is on disk exactly once. Run from the backend
+directory:
+
+    python -m benchmarks.bench_workers --workers 4 --clients 16 --requests 50
+
+Exits with status 1 if any record was lost or duplicated.
+``tests/test_workers.py`` runs a smaller load through ``run_load``.
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict
+
+import httpx
+
+from services.serialization import read_json
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(base_url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def client_session(base_url: str, client: int, requests: int):
+    """Create conversations, update every other one and delete every fifth"""
+
+    kept, deleted = [], []
+    with httpx.Client(base_url=base_url, timeout=60) as http:
+        for i in range(requests):
+            response = http.post("/api/conversations", json={"title": f"client {client} #{i}"})
+            response.raise_for_status()
+            conversation = response.json()
+            if i % 2 == 0:
+                conversation["title"] += " (edited)"
+                http.put(f"/api/conversations/{conversation['id']}", json=conversation).raise_for_status()
+            if i % 5 == 0:
+                http.delete(f"/api/conversations/{conversation['id']}").raise_for_status()
+                deleted.append(conversation["id"])
+            else:
+                kept.append((conversation["id"], conversation["title"]))
+    return kept, deleted
+
+
+def run_load(workers: int, clients: int, requests: int) -> Dict[str, Any]:
+    """Drive a ``workers``-process server and compare what is stored with what was acknowledged"""
+
+    with tempfile.TemporaryDirectory() as home:
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+             "--workers", str(workers), "--log-level", "warning"],
+            env=dict(os.environ, HOME=home),
+        )
+        try:
+            wait_until_ready(base_url)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as pool:
+                results = list(pool.map(
+                    lambda client: client_session(base_url, client, requests),
+                    range(clients),
+                ))
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+        stored = read_json(Path(home) / "Documents" / "datasets" / "conversations.json")
+
+    expected = {conversation_id: title for kept, _ in results for conversation_id, title in kept}
+    deleted = {conversation_id for _, gone in results for conversation_id in gone}
+    counts = Counter(conversation["id"] for conversation in stored)
+    titles = {conversation["id"]: conversation.get("title") for conversation in stored}
+
+    return {
+        "elapsed": elapsed,
+        "writes": clients * requests,
+        "expected": len(expected),
+        "stored": len(stored),
+        "lost": [cid for cid in expected if cid not in counts],
+        "duplicated": [cid for cid, count in counts.items() if count > 1],
+        "resurrected": [cid for cid in deleted if cid in counts],
+        "stale": [cid for cid, title in expected.items() if cid in titles and titles[cid] != title],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    result = run_load(args.workers, args.clients, args.requests)
+    writes, elapsed = result["writes"], result["elapsed"]
+
+    print(f"workers: {args.workers}, clients: {args.clients}, writes acknowledged: {writes}")
+    print(f"elapsed: {elapsed:.1f}s ({writes / elapsed:.0f} creates/s plus updates and deletes)")
+    print(f"expected {result['expected']} records, found {result['stored']}")
+    print(f"lost: {len(result['lost'])}, duplicated: {len(result['duplicated'])}, "
+          f"resurrected: {len(result['resurrected'])}, stale updates: {len(result['stale'])}")
+
+    failed = any(result[key] for key in ("lost", "duplicated", "resurrected", "stale"))
+    sys.exit(1 if failed or result["stored"] != result["expected"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,6 @@
 Database configuration and session management
 """
 
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.pool import StaticPool
 import os
 
 # from config import settings
@@ -14,6 +10,10 @@ import os
 # Database configuration
 # DATABASE_URL = settings.DATABASE_URL
 
+# from sqlalchemy import create_engine
+# from sqlalchemy.orm import sessionmaker, Session
+# from sqlalchemy.pool import StaticPool
+
 # engine = create_engine(
 #     DATABASE_URL,
 #     echo=settings.DATABASE_ECHO,
@@ -25,7 +25,18 @@ import os
 
 # SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
+# SQLAlchemy is imported on first access to Base so that importing this module
+# does not pull it into processes that never touch the database
+_base = None
+
+def __getattr__(name):
+    global _base
+    if name == "Base":
+        if _base is None:
+            from sqlalchemy.ext.declarative import declarative_base
+            _base = declarative_base()
+        return _base
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # def get_db() -> Session:
 #     """Dependency to get database session"""
@@ -1,19 +1,41 @@
+import time
 
-from fastapi import FastAPI, HTTPException, Depends, status
+# Taken before any other import so the startup report covers framework imports
+STARTED_AT = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from pydantic import ValidationError
 from pathlib import Path
 import os
-import json
 from typing import List, Dict, Any, Optional
 import uuid
 from datetime import datetime
-import uvicorn
+import logging
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; the startup report then omits memory use
+    resource = None
+
+from models.records import ConversationRecord, DatasetRecord, TrainedModelRecord
+from models.schemas import DatasetEntryCreate
+from services.change_feed import ChangeFeed, ChangeLog, event_stream, parse_event_id
+from services.dedup import DEDUP_MODES, DedupIndexes
+from services.http_cache import GZIP_LEVEL, SelectiveGZipMiddleware, conditional_response
+from services.profiler import ProfiledRoute, ProfileStore, ProfilingMiddleware
+from services.serialization import FastJSONResponse, dumps
+from services.sharding import DEFAULT_USER, ShardedStore
+from services.snapshots import SnapshotRepository
 
 app = FastAPI(
     title="DealMind Lab API",
     description="AI Negotiation Training System Backend",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
 app.add_middleware(
@@ -24,6 +46,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request profiling is opt-in; when disabled the middleware is never installed
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0.0"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", "profiles")
+PROFILING_MAX_PROFILES = int(os.getenv("PROFILING_MAX_PROFILES", "200"))
+
+profile_store = ProfileStore(Path(PROFILING_DIR), max_profiles=PROFILING_MAX_PROFILES)
+
+if PROFILING_ENABLED:
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=profile_store,
+        sample_rate=PROFILING_SAMPLE_RATE,
+    )
+    # Set before any route is declared so sync endpoints are profiled in their worker thread
+    app.router.route_class = ProfiledRoute
+
+# Bodies above this size are compressed; dataset endpoints cache their
+# compressed bodies per version, everything else goes through GZipMiddleware
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+
+app.add_middleware(
+    SelectiveGZipMiddleware,
+    excluded_paths=("/api/changes",),
+    minimum_size=COMPRESSION_MINIMUM_SIZE,
+    compresslevel=GZIP_LEVEL,
+)
+
 security = HTTPBearer()
 
 def get_datasets_dir():
@@ -32,26 +82,81 @@ def get_datasets_dir():
     datasets_dir.mkdir(parents=True, exist_ok=True)
     return datasets_dir
 
-def get_conversations_file():
-    datasets_dir = get_datasets_dir()
-    conversations_file = datasets_dir / "conversations.json"
-    if not conversations_file.exists():
-        conversations_file.write_text("[]")
-    return conversations_file
-
-def get_table_data_file():
-    datasets_dir = get_datasets_dir()
-    table_data_file = datasets_dir / "table_data.json"
-    if not table_data_file.exists():
-        table_data_file.write_text("[]")
-    return table_data_file
-
-def get_models_file():
-    datasets_dir = get_datasets_dir()
-    models_file = datasets_dir / "trained_models.json"
-    if not models_file.exists():
-        models_file.write_text("[]")
-    return models_file
+# Every dataset mutation is appended to a log shared by all workers, which
+# each worker tails and streams from /api/changes
+CHANGE_FEED_HISTORY = int(os.getenv("CHANGE_FEED_HISTORY", "1000"))
+change_feed = ChangeFeed(
+    history_size=CHANGE_FEED_HISTORY,
+    max_pending=int(os.getenv("CHANGE_FEED_MAX_PENDING", "1000")),
+    log=ChangeLog(lambda: get_datasets_dir() / "changes.log", max_events=CHANGE_FEED_HISTORY),
+)
+CHANGE_FEED_HEARTBEAT = float(os.getenv("CHANGE_FEED_HEARTBEAT", "15"))
+
+def publish_change(user_id: str, dataset: str, action: str, record_id: Optional[str],
+                   record: Optional[Dict[str, Any]]):
+    change_feed.publish(dataset, action, record_id, record, user_id=user_id)
+
+# Each user's datasets live in their own shard; the default user keeps the
+# top-level files in the datasets directory
+dataset_store = ShardedStore(
+    get_datasets_dir,
+    {
+        "conversations": ("conversations.json", ConversationRecord),
+        "table_data": ("table_data.json", DatasetRecord),
+        "models": ("trained_models.json", TrainedModelRecord),
+    },
+    on_change=publish_change,
+    max_open_shards=int(os.getenv("MAX_OPEN_SHARDS", "256")),
+    scan_workers=int(os.getenv("SHARD_SCAN_WORKERS", "8")),
+)
+
+# New dataset rows are screened for near-duplicates of existing rows:
+# "flag" marks them in metadata, "reject" refuses them, "off" skips the check
+DEDUP_MODE = os.getenv("DEDUP_MODE", "flag")
+if DEDUP_MODE not in DEDUP_MODES:
+    raise ValueError(f"DEDUP_MODE must be one of {', '.join(DEDUP_MODES)}")
+
+dedup_indexes = DedupIndexes(
+    lambda user_id: dataset_store.store(user_id, "table_data"),
+    threshold=float(os.getenv("DEDUP_THRESHOLD", "0.85")),
+    max_indexes=int(os.getenv("DEDUP_MAX_INDEXES", "64")),
+)
+
+@app.on_event("startup")
+async def warm_dedup_indexes():
+    # Built off the event loop so the first write for each user does not pay for it
+    if DEDUP_MODE != "off":
+        dedup_indexes.warm(dataset_store.users())
+
+def get_snapshot_dir():
+    snapshot_dir = os.getenv("SNAPSHOT_DIR")
+    return Path(snapshot_dir) if snapshot_dir else Path.home() / "Documents" / "dataset-snapshots"
+
+# Incremental snapshots of the whole datasets directory, taken without stopping writers
+snapshot_repository = SnapshotRepository(
+    get_snapshot_dir,
+    get_datasets_dir,
+    workers=int(os.getenv("SNAPSHOT_WORKERS", "4")),
+    # Restored files replace what subscribers have, so they must refetch
+    on_restore=lambda snapshot_id: change_feed.publish(None, "reset", None),
+)
+
+def get_user_id(x_user_id: Optional[str] = Header(None, max_length=200)) -> str:
+    return x_user_id or DEFAULT_USER
+
+# uvicorn only configures its own loggers; "uvicorn.error" is its general log
+logger = logging.getLogger("uvicorn.error")
+
+startup_report: Dict[str, Any] = {}
+
+@app.on_event("startup")
+async def record_startup_time():
+    startup_report["startup_ms"] = round((time.perf_counter() - STARTED_AT) * 1000, 1)
+    if resource is not None:
+        # ru_maxrss is reported in kilobytes on Linux
+        startup_report["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    logger.info("DealMind API started in %s ms, max RSS %s MB",
+                startup_report["startup_ms"], startup_report.get("max_rss_mb", "n/a"))
 
 @app.get("/")
 async def root():
@@ -61,90 +166,110 @@ async def root():
 async def health_check():
     return {"status": "healthy", "service": "dealmind-api"}
 
+# Store calls take the dataset's flock and do file I/O, so every endpoint that
+# touches the store is a plain def and runs in the threadpool; waiting on a lock
+# held by another worker then cannot stall the event loop and its SSE streams
 @app.get("/api/conversations")
-async def get_conversations():
-    conversations_file = get_conversations_file()
-    with open(conversations_file, 'r') as f:
-        conversations = json.load(f)
-    return conversations
+def get_conversations(request: Request, user_id: str = Depends(get_user_id)):
+    store = dataset_store.store(user_id, "conversations")
+    return conditional_response(request, store, COMPRESSION_MINIMUM_SIZE)
 
 @app.post("/api/conversations")
-async def create_conversation(conversation: Dict[str, Any]):
-    conversations_file = get_conversations_file()
-    with open(conversations_file, 'r') as f:
-        conversations = json.load(f)
-    
+def create_conversation(conversation: Dict[str, Any], user_id: str = Depends(get_user_id)):
     conversation['id'] = str(uuid.uuid4())
     conversation['created_at'] = datetime.now().isoformat()
-    conversations.append(conversation)
-    
-    with open(conversations_file, 'w') as f:
-        json.dump(conversations, f, indent=2)
+    record = dataset_store.store(user_id, "conversations").add(conversation)
     
-    return conversation
+    return record.to_dict()
 
 @app.put("/api/conversations/{conversation_id}")
-async def update_conversation(conversation_id: str, conversation: Dict[str, Any]):
-    conversations_file = get_conversations_file()
-    with open(conversations_file, 'r') as f:
-        conversations = json.load(f)
-    
-    for i, conv in enumerate(conversations):
-        if conv['id'] == conversation_id:
-            conversation['id'] = conversation_id
-            conversations[i] = conversation
-            break
-    else:
+def update_conversation(
+    conversation_id: str,
+    conversation: Dict[str, Any],
+    user_id: str = Depends(get_user_id)
+):
+    conversation['id'] = conversation_id
+    record = dataset_store.store(user_id, "conversations").replace(conversation_id, conversation)
+    if record is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    with open(conversations_file, 'w') as f:
-        json.dump(conversations, f, indent=2)
-    
-    return conversation
+    return record.to_dict()
 
 @app.delete("/api/conversations/{conversation_id}")
-async def delete_conversation(conversation_id: str):
-    conversations_file = get_conversations_file()
-    with open(conversations_file, 'r') as f:
-        conversations = json.load(f)
-    
-    conversations = [conv for conv in conversations if conv['id'] != conversation_id]
-    
-    with open(conversations_file, 'w') as f:
-        json.dump(conversations, f, indent=2)
+def delete_conversation(conversation_id: str, user_id: str = Depends(get_user_id)):
+    dataset_store.store(user_id, "conversations").delete(conversation_id)
     
     return {"message": "Conversation deleted successfully"}
 
 @app.get("/api/table-data")
-async def get_table_data():
-    table_data_file = get_table_data_file()
-    with open(table_data_file, 'r') as f:
-        table_data = json.load(f)
-    return table_data
+def get_table_data(request: Request, user_id: str = Depends(get_user_id)):
+    store = dataset_store.store(user_id, "table_data")
+    return conditional_response(request, store, COMPRESSION_MINIMUM_SIZE)
+
+def validate_dataset_entry(data: Dict[str, Any], loc_prefix: tuple = ()):
+    try:
+        DatasetEntryCreate.model_validate(data)
+    except ValidationError as e:
+        errors = e.errors(include_url=False)
+        for error in errors:
+            error["loc"] = loc_prefix + tuple(error["loc"])
+        raise HTTPException(status_code=422, detail=errors)
+
+def add_table_rows(user_id: str, rows: List[Dict[str, Any]]):
+    """Write rows in one file write, screening dataset entries for near-duplicates"""
+    
+    store = dataset_store.store(user_id, "table_data")
+    index = dedup_indexes.index(user_id)
+    entries = [row for row in rows if DatasetRecord.is_entry(row)]
+    accepted, rejected = index.screen(entries, DEDUP_MODE)
+    accepted_ids = {row['id'] for row in accepted}
+    rows = [row for row in rows if not DatasetRecord.is_entry(row) or row['id'] in accepted_ids]
+    if not rows:
+        return [], rejected
+    try:
+        records = store.add_many(rows)
+    except BaseException:
+        index.invalidate()
+        raise
+    index.committed()
+    return records, rejected
 
 @app.post("/api/table-data")
-async def save_table_data(data: Dict[str, Any]):
-    table_data_file = get_table_data_file()
+def save_table_data(data: Dict[str, Any], user_id: str = Depends(get_user_id)):
+    if DatasetRecord.is_entry(data):
+        validate_dataset_entry(data)
     
     data['id'] = str(uuid.uuid4())
     data['createdAt'] = datetime.now().isoformat()
+    records, rejected = add_table_rows(user_id, [data])
+    if rejected:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Near-duplicate of existing dataset entries", **rejected[0]}
+        )
     
-    with open(table_data_file, 'r') as f:
-        existing_data = json.load(f)
-    
-    existing_data.append(data)
-    
-    with open(table_data_file, 'w') as f:
-        json.dump(existing_data, f, indent=2)
+    return records[0].to_dict()
+
+@app.post("/api/table-data/bulk")
+def bulk_save_table_data(rows: List[Dict[str, Any]], user_id: str = Depends(get_user_id)):
+    created_at = datetime.now().isoformat()
+    for i, data in enumerate(rows):
+        if DatasetRecord.is_entry(data):
+            validate_dataset_entry(data, loc_prefix=("body", i))
+        data['id'] = str(uuid.uuid4())
+        data['createdAt'] = created_at
+    records, rejected = add_table_rows(user_id, rows)
     
-    return data
+    return {
+        "created": [record.to_dict() for record in records],
+        "rejected": rejected,
+        "flagged": sum(1 for record in records if (record.get("metadata") or {}).get("near_duplicate_of"))
+    }
 
 @app.get("/api/models")
-async def get_trained_models():
-    models_file = get_models_file()
-    with open(models_file, 'r') as f:
-        models = json.load(f)
-    return models
+def get_trained_models(request: Request, user_id: str = Depends(get_user_id)):
+    store = dataset_store.store(user_id, "models")
+    return conditional_response(request, store, COMPRESSION_MINIMUM_SIZE)
 
 @app.post("/api/models/train")
 async def train_model(config: Dict[str, Any]):
@@ -155,41 +280,124 @@ async def train_model(config: Dict[str, Any]):
     }
 
 @app.post("/api/models")
-async def save_trained_model(model: Dict[str, Any]):
-    models_file = get_models_file()
-    with open(models_file, 'r') as f:
-        models = json.load(f)
-    
+def save_trained_model(model: Dict[str, Any], user_id: str = Depends(get_user_id)):
     model['id'] = str(uuid.uuid4())
     model['trainingDate'] = datetime.now().isoformat()
-    models.append(model)
-    
-    with open(models_file, 'w') as f:
-        json.dump(models, f, indent=2)
+    record = dataset_store.store(user_id, "models").add(model)
     
-    return model
+    return record.to_dict()
 
+# Admin and export endpoints may scan every shard, so they are plain def as well
 @app.get("/api/export/{data_type}")
-async def export_data(data_type: str):
-    if data_type == "conversations":
-        file_path = get_conversations_file()
-    elif data_type == "table_data":
-        file_path = get_table_data_file()
-    elif data_type == "models":
-        file_path = get_models_file()
-    else:
+def export_data(
+    data_type: str,
+    all_users: bool = Query(False),
+    user_id: str = Depends(get_user_id)
+):
+    if data_type not in dataset_store.datasets:
         raise HTTPException(status_code=404, detail="Data type not found")
     
-    with open(file_path, 'r') as f:
-        data = json.load(f)
+    if all_users:
+        # Read every shard in parallel and splice the encoded arrays together
+        bodies = dataset_store.scan(data_type, lambda _, store: store.encoded().strip()[1:-1].strip())
+        body = b"[" + b",".join(part for part in bodies.values() if part) + b"]"
+    else:
+        body = dataset_store.store(user_id, data_type).encoded()
+    
+    filename = f"{data_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
     
-    return {"data": data, "filename": f"{data_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"}
+    return FastJSONResponse(b'{"data":' + body + b',"filename":' + dumps(filename) + b'}')
+
+@app.get("/api/changes")
+async def stream_changes(
+    request: Request,
+    since: Optional[str] = Query(None),
+    user_id: Optional[str] = Query(None, max_length=200),
+    header_user_id: str = Depends(get_user_id)
+):
+    # EventSource sends Last-Event-ID on reconnect; other clients pass ?since=
+    since_seq, resumable = parse_event_id(
+        request.headers.get("last-event-id") or since, change_feed.stream_id
+    )
+    # EventSource cannot send headers, so ?user_id= also selects the user; * means all
+    user_filter = user_id or header_user_id
+    return StreamingResponse(
+        event_stream(
+            change_feed, since_seq, resumable,
+            heartbeat=CHANGE_FEED_HEARTBEAT,
+            user_id=None if user_filter == "*" else user_filter
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/admin/shards")
+def get_shard_stats():
+    def shard_stats(user_id, store):
+        return {"records": len(store.records()), "bytes": store.version()[1]}
+    
+    stats: Dict[str, Dict[str, Any]] = {}
+    for dataset in dataset_store.datasets:
+        for user_id, result in dataset_store.scan(dataset, shard_stats).items():
+            stats.setdefault(user_id, {})[dataset] = result
+    return {"users": len(stats), "shards": stats}
+
+@app.post("/api/admin/shards/migrate")
+def migrate_default_shard():
+    return {"moved": dataset_store.migrate_default_shard()}
+
+# Plain def so the file work runs in the threadpool instead of the event loop
+@app.post("/api/admin/snapshots")
+def create_snapshot():
+    return snapshot_repository.create()
+
+@app.get("/api/admin/snapshots")
+def list_snapshots():
+    return {"snapshots": snapshot_repository.list()}
+
+@app.post("/api/admin/snapshots/{snapshot_id}/restore")
+def restore_snapshot(snapshot_id: str):
+    try:
+        return snapshot_repository.restore(snapshot_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+
+@app.post("/api/admin/snapshots/prune")
+def prune_snapshots(keep: int = Query(..., ge=1)):
+    return snapshot_repository.prune(keep)
+
+@app.get("/api/admin/ai-coordinator")
+async def get_ai_coordinator_stats():
+    # Imported here so startup does not pay for the AI service module
+    from services.ai_service import default_coordinator
+    return {"providers": default_coordinator.stats()}
+
+@app.get("/api/admin/startup")
+async def get_startup_report():
+    return startup_report
+
+# Summarising profiles reads them from disk, so this runs in the threadpool
+@app.get("/api/admin/profiles")
+def get_slowest_profiles(
+    limit: int = Query(20, ge=1, le=200),
+    route: Optional[str] = Query(None),
+    top: int = Query(10, ge=1, le=100)
+):
+    return {
+        "enabled": PROFILING_ENABLED,
+        "sample_rate": PROFILING_SAMPLE_RATE,
+        "profiles": profile_store.slowest(limit=limit, route=route, top_functions=top)
+    }
 
 if __name__ == "__main__":
+    import uvicorn
+    # Storage is multi-process safe; --reload cannot be combined with workers
+    workers = int(os.getenv("WORKERS", "1"))
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        reload=workers == 1,
+        workers=workers,
         log_level="info"
     )
@@ -0,0 +1,197 @@
+"""
+Compact in-memory records for stored conversations, dataset rows and models
+
+Stored JSON documents are decoded into ``__slots__`` records instead of being
+kept as plain dicts. Categorical strings such as ``intent``, ``business_type``
+and ``outcome`` are interned so every record shares one copy, and list fields
+become tuples. Keys a record type does not know about are kept in ``extra`` so
+``to_dict`` always reproduces the original document.
+"""
+
+import sys
+from typing import Any, Callable, ClassVar, Dict, FrozenSet, Tuple
+
+
+class _Missing:
+    """Marks a field that was absent from the stored document"""
+
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return "MISSING"
+
+    def __bool__(self) -> bool:
+        return False
+
+
+MISSING: Any = _Missing()
+
+_intern = sys.intern
+
+
+def _intern_tags(value: Any) -> Any:
+    if type(value) is list:
+        return tuple(_intern(tag) if type(tag) is str else tag for tag in value)
+    return value
+
+
+def _tags_to_list(value: Any) -> Any:
+    return list(value) if type(value) is tuple else value
+
+
+class CompactRecord:
+    """Base class for slot-based records decoded from stored JSON"""
+
+    __slots__ = ("extra",)
+
+    FIELDS: ClassVar[Tuple[str, ...]] = ()
+    INTERNED: ClassVar[FrozenSet[str]] = frozenset()
+    DECODERS: ClassVar[Dict[str, Callable[[Any], Any]]] = {}
+    ENCODERS: ClassVar[Dict[str, Callable[[Any], Any]]] = {}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]):
+        """Build a record, taking ownership of ``data``"""
+
+        record = cls.__new__(cls)
+        interned = cls.INTERNED
+        decoders = cls.DECODERS
+        for name in cls.FIELDS:
+            value = data.pop(name, MISSING)
+            if value is not MISSING:
+                if name in interned:
+                    if type(value) is str:
+                        value = _intern(value)
+                elif name in decoders:
+                    value = decoders[name](value)
+            setattr(record, name, value)
+        record.extra = data or None
+        return record
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Rebuild the JSON document this record was decoded from"""
+
+        encoders = self.ENCODERS
+        result = {}
+        for name in self.FIELDS:
+            value = getattr(self, name)
+            if value is MISSING:
+                continue
+            if name in encoders:
+                value = encoders[name](value)
+            result[name] = value
+        if self.extra:
+            result.update(self.extra)
+        return result
+
+    def get(self, name: str, default: Any = None) -> Any:
+        """Look up a field or extra key like ``dict.get``"""
+
+        if name in self.FIELDS:
+            value = getattr(self, name)
+            return default if value is MISSING else value
+        if self.extra:
+            return self.extra.get(name, default)
+        return default
+
+    def __eq__(self, other: Any) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class MessageRecord(CompactRecord):
+    """A single turn in a stored conversation"""
+
+    __slots__ = ("role", "content", "timestamp")
+    FIELDS = __slots__
+    INTERNED = frozenset({"role"})
+
+
+class ConversationMetadata(CompactRecord):
+    """Labels attached to a stored conversation"""
+
+    __slots__ = ("intent", "outcome", "final_price", "business_type", "complexity", "tags")
+    FIELDS = __slots__
+    INTERNED = frozenset({"intent", "outcome", "business_type", "complexity"})
+    DECODERS = {"tags": _intern_tags}
+    ENCODERS = {"tags": _tags_to_list}
+
+
+def _decode_messages(value: Any) -> Any:
+    if type(value) is list:
+        return tuple(
+            MessageRecord.from_dict(message) if type(message) is dict else message
+            for message in value
+        )
+    return value
+
+
+def _encode_messages(value: Any) -> Any:
+    if type(value) is tuple:
+        return [
+            message.to_dict() if isinstance(message, CompactRecord) else message
+            for message in value
+        ]
+    return value
+
+
+def _decode_metadata(value: Any) -> Any:
+    return ConversationMetadata.from_dict(value) if type(value) is dict else value
+
+
+def _encode_record(value: Any) -> Any:
+    return value.to_dict() if isinstance(value, CompactRecord) else value
+
+
+class ConversationRecord(CompactRecord):
+    """A stored conversation from ``conversations.json``"""
+
+    __slots__ = ("id", "title", "messages", "metadata", "created_at", "is_favorite")
+    FIELDS = __slots__
+    DECODERS = {"messages": _decode_messages, "metadata": _decode_metadata}
+    ENCODERS = {"messages": _encode_messages, "metadata": _encode_record}
+
+
+class DatasetRecord(CompactRecord):
+    """An item from ``table_data.json``
+
+    Items are either tables saved from the dashboard (``headers``/``entries``)
+    or individual dataset rows shaped like ``DatasetEntryCreate``.
+    """
+
+    __slots__ = (
+        "id", "headers", "entries", "customer_message", "business_response",
+        "intent", "business_type", "outcome", "tags", "metadata", "user_id",
+        "createdAt",
+    )
+    FIELDS = __slots__
+    INTERNED = frozenset({"intent", "business_type", "outcome", "user_id"})
+    DECODERS = {"tags": _intern_tags}
+    ENCODERS = {"tags": _tags_to_list}
+
+    @staticmethod
+    def is_entry(data: Dict[str, Any]) -> bool:
+        """Whether a raw item is a dataset row rather than a saved table"""
+        return "customer_message" in data or "business_response" in data
+
+
+class TrainedModelRecord(CompactRecord):
+    """A stored model from ``trained_models.json``"""
+
+    __slots__ = ("id", "name", "accuracy", "loss", "trainingDate", "status")
+    FIELDS = __slots__
+    INTERNED = frozenset({"status"})
+
+
+def decode_records(record_type, documents: Any) -> list:
+    """Decode a stored JSON array into records of ``record_type``"""
+
+    if not isinstance(documents, list):
+        raise ValueError(f"Expected a JSON array of {record_type.__name__} documents")
+    from_dict = record_type.from_dict
+    return [from_dict(document) for document in documents]
+
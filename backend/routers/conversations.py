@@ -4,10 +4,10 @@ Conversation simulation endpoints
 """
 
 from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
 from typing import List
 import json
 
+# from sqlalchemy.orm import Session
 # from database import get_db
 # from models.schemas import ConversationSession, ConversationSessionCreate, Message, MessageCreate
 # from services.auth import get_current_user
@@ -4,10 +4,10 @@ Dataset management endpoints
 """
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy.orm import Session
 from typing import List, Optional
 import uuid
 
+# from sqlalchemy.orm import Session
 # from database import get_db
 # from models.schemas import DatasetEntry, DatasetEntryCreate, DatasetResponse
 # from services.auth import get_current_user
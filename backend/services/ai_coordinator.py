@@ -0,0 +1,272 @@
+"""
+Coordination of outbound AI provider calls
+
+Every provider call goes through a ``RequestCoordinator``, which
+
+- coalesces identical in-flight requests onto a single provider call,
+- enforces per-provider token buckets for requests and tokens per minute,
+- caps concurrency and queue depth, shedding load that would wait longer
+  than ``max_wait`` seconds, and
+- backs off when a provider answers 429, honouring ``Retry-After``.
+
+Queue depth, coalescing and wait times are kept per provider for ``stats``.
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from services.serialization import dumps
+
+
+class ProviderOverloaded(Exception):
+    """Raised when a request is shed instead of waiting for provider capacity"""
+
+    def __init__(self, provider: str, reason: str):
+        super().__init__(f"{provider} is overloaded: {reason}")
+        self.provider = provider
+        self.reason = reason
+
+
+@dataclass
+class ProviderLimits:
+    requests_per_minute: float = 60
+    tokens_per_minute: float = 90_000
+    max_concurrency: int = 8
+    max_queue: int = 100
+    max_wait: float = 30.0
+    max_retries: int = 3
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate`` tokens per second"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, amount: float) -> float:
+        """Seconds until ``amount`` tokens are available"""
+
+        now = time.monotonic()
+        self._refill(now)
+        pause = max(0.0, self.paused_until - now)
+        # Requests larger than the bucket are admitted once it is full
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return pause
+        return max(pause, (amount - self.tokens) / self.rate)
+
+    def consume(self, amount: float) -> None:
+        # May go negative: a request that used more than estimated is paid back later
+        self._refill(time.monotonic())
+        self.tokens -= amount
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class ProviderState:
+    """Limits, buckets and metrics for one provider"""
+
+    def __init__(self, name: str, limits: ProviderLimits):
+        self.name = name
+        self.limits = limits
+        self.requests = TokenBucket(limits.requests_per_minute / 60, max(1.0, limits.requests_per_minute / 60))
+        self.tokens = TokenBucket(limits.tokens_per_minute / 60, limits.tokens_per_minute / 60 * 10)
+        self.concurrency = asyncio.Semaphore(limits.max_concurrency)
+        self.admission = asyncio.Lock()
+        self.queued = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.coalesced = 0
+        self.shed = 0
+        self.rate_limited = 0
+        self.wait_times: Deque[float] = deque(maxlen=1000)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self.wait_times)
+
+        def percentile(p: float) -> Optional[float]:
+            if not waits:
+                return None
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 1)
+
+        return {
+            "queue_depth": self.queued,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "shed": self.shed,
+            "rate_limited": self.rate_limited,
+            "wait_ms_p50": percentile(0.5),
+            "wait_ms_p95": percentile(0.95),
+            "wait_ms_max": round(waits[-1] * 1000, 1) if waits else None,
+            "tokens_available": round(self.tokens.tokens),
+        }
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    return getattr(exc, "status_code", None) == 429
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def request_key(provider: str, payload: Dict[str, Any]) -> str:
+    """Coalescing key; whitespace and case differences in text are ignored"""
+
+    def normalise(value: Any) -> Any:
+        if isinstance(value, str):
+            return " ".join(value.split()).lower()
+        if isinstance(value, dict):
+            return {k: normalise(v) for k, v in sorted(value.items())}
+        if isinstance(value, (list, tuple)):
+            return [normalise(v) for v in value]
+        return value
+
+    return hashlib.sha256(dumps([provider, normalise(payload)])).hexdigest()
+
+
+class _Flight:
+    """A provider call shared by every caller waiting on the same key"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class RequestCoordinator:
+    """Single-flight and admission control in front of provider calls"""
+
+    def __init__(self, limits: Optional[Dict[str, ProviderLimits]] = None,
+                 default_limits: Optional[ProviderLimits] = None):
+        self.limits = limits or {}
+        self.default_limits = default_limits or ProviderLimits()
+        self._providers: Dict[str, ProviderState] = {}
+        self._in_flight: Dict[str, _Flight] = {}
+
+    def provider(self, name: str) -> ProviderState:
+        state = self._providers.get(name)
+        if state is None:
+            state = ProviderState(name, self.limits.get(name, self.default_limits))
+            self._providers[name] = state
+        return state
+
+    async def submit(self, provider: str, key: str, call: Callable[[], Awaitable[Any]],
+                     estimated_tokens: int = 1000,
+                     tokens_used: Callable[[Any], Optional[int]] = lambda result: None) -> Any:
+        """Run ``call`` under ``provider``'s limits, sharing it with identical requests"""
+
+        state = self.provider(provider)
+        flight = self._in_flight.get(key)
+        if flight is None:
+            # The call runs in its own task, so no single caller owns it
+            flight = _Flight(asyncio.ensure_future(self._run(state, call, estimated_tokens, tokens_used)))
+            self._in_flight[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            state.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            # Only the last caller to leave cancels a call that is still running
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def _forget(self, key: str, flight: "_Flight") -> None:
+        if self._in_flight.get(key) is flight:
+            del self._in_flight[key]
+
+    async def _admit(self, state: ProviderState, estimated_tokens: int, deadline: float) -> None:
+        """Wait for request and token budget, or shed if it would pass ``deadline``"""
+
+        # One waiter at a time takes budget, so requests are admitted in order
+        try:
+            await asyncio.wait_for(state.admission.acquire(), max(0.001, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            state.shed += 1
+            raise ProviderOverloaded(state.name, "rate limit wait exceeds max_wait")
+        try:
+            while True:
+                delay = max(state.requests.delay_for(1), state.tokens.delay_for(estimated_tokens))
+                if delay <= 0:
+                    state.requests.consume(1)
+                    state.tokens.consume(estimated_tokens)
+                    return
+                if time.monotonic() + delay > deadline:
+                    state.shed += 1
+                    raise ProviderOverloaded(state.name, "rate limit wait exceeds max_wait")
+                await asyncio.sleep(delay)
+        finally:
+            state.admission.release()
+
+    async def _run(self, state: ProviderState, call: Callable[[], Awaitable[Any]],
+                   estimated_tokens: int, tokens_used: Callable[[Any], Optional[int]]) -> Any:
+        limits = state.limits
+        if state.queued >= limits.max_queue:
+            state.shed += 1
+            raise ProviderOverloaded(state.name, "queue is full")
+
+        queued_at = time.monotonic()
+        deadline = queued_at + limits.max_wait
+        state.queued += 1
+        try:
+            await self._admit(state, estimated_tokens, deadline)
+            try:
+                await asyncio.wait_for(state.concurrency.acquire(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                state.shed += 1
+                raise ProviderOverloaded(state.name, "no free concurrency slot within max_wait")
+        finally:
+            state.queued -= 1
+        state.wait_times.append(time.monotonic() - queued_at)
+
+        state.in_flight += 1
+        try:
+            for attempt in range(limits.max_retries + 1):
+                state.calls += 1
+                try:
+                    result = await call()
+                except Exception as exc:
+                    if not is_rate_limited(exc) or attempt == limits.max_retries:
+                        raise
+                    state.rate_limited += 1
+                    backoff = retry_after(exc) or min(2 ** attempt, limits.max_wait)
+                    # Pause the whole provider, not just this request
+                    state.requests.pause(backoff)
+                    if time.monotonic() + backoff > deadline:
+                        raise
+                    await self._admit(state, estimated_tokens, deadline)
+                    continue
+                used = tokens_used(result)
+                if used is not None:
+                    state.tokens.consume(used - estimated_tokens)
+                return result
+        finally:
+            state.in_flight -= 1
+            state.concurrency.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: state.stats() for name, state in self._providers.items()}
@@ -3,158 +3,235 @@
 AI Service for model integrations and responses
 """
 
-import openai
-import anthropic
 from typing import List, Dict, Any, Optional
 import asyncio
+import os
 import time
+from dataclasses import fields
 
-# from models.schemas import ChatRequest, ChatResponse, Message
+from models.schemas import ChatResponse, Message
+from services.ai_coordinator import ProviderLimits, ProviderOverloaded, RequestCoordinator, request_key
 # from config import settings
 
+DEFAULT_MAX_TOKENS = 1000
+
+def _limits_from_env(prefix: str, **defaults) -> ProviderLimits:
+    # <PREFIX>_<FIELD> overrides any ProviderLimits field, e.g. OPENAI_MAX_WAIT
+    limits = ProviderLimits(**defaults)
+    for field in fields(ProviderLimits):
+        value = os.getenv(f"{prefix}_{field.name.upper()}")
+        if value is not None:
+            setattr(limits, field.name, field.type(value))
+    return limits
+
+# Shared by every AIService so all callers draw from the same provider budgets
+default_coordinator = RequestCoordinator({
+    "openai": _limits_from_env("OPENAI", requests_per_minute=500, tokens_per_minute=200_000),
+    "anthropic": _limits_from_env("ANTHROPIC", requests_per_minute=50, tokens_per_minute=40_000),
+})
+
 class AIService:
-    def __init__(self):
-        # Initialize AI clients
-        # self.openai_client = openai.AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-        # self.anthropic_client = anthropic.AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY)
-        pass
+    def __init__(self, coordinator: Optional[RequestCoordinator] = None):
+        # Provider SDKs are slow to import, so clients are created on first use.
+        # Their built-in retries are off: 429s are retried by the coordinator.
+        self._openai_client = None
+        self._anthropic_client = None
+        self.coordinator = coordinator or default_coordinator
     
-    # async def generate_response(
-    #     self, 
-    #     model_id: str, 
-    #     conversation_history: List[Message],
-    #     context: Dict[str, Any] = {},
-    #     temperature: float = 0.7,
-    #     max_tokens: Optional[int] = None
-    # ) -> ChatResponse:
-    #     """Generate AI response based on conversation history"""
-        
-    #     start_time = time.time()
-        
-    #     try:
-    #         if model_id.startswith("gpt"):
-    #             response = await self._generate_openai_response(
-    #                 model_id, conversation_history, context, temperature, max_tokens
-    #             )
-    #         elif model_id.startswith("claude"):
-    #             response = await self._generate_anthropic_response(
-    #                 model_id, conversation_history, context, temperature, max_tokens
-    #             )
-    #         else:
-    #             raise ValueError(f"Unsupported model: {model_id}")
-            
-    #         response_time = time.time() - start_time
-            
-    #         return ChatResponse(
-    #             message=response["content"],
-    #             model_used=model_id,
-    #             tokens_used=response["tokens_used"],
-    #             response_time=response_time
-    #         )
-            
-    #     except Exception as e:
-    #         raise Exception(f"AI generation failed: {str(e)}")
+    @property
+    def openai_client(self):
+        """OpenAI client, importing the SDK the first time it is needed"""
+        if self._openai_client is None:
+            import openai
+            self._openai_client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        return self._openai_client
     
-    # async def _generate_openai_response(
-    #     self, 
-    #     model_id: str, 
-    #     conversation_history: List[Message],
-    #     context: Dict[str, Any],
-    #     temperature: float,
-    #     max_tokens: Optional[int]
-    # ) -> Dict[str, Any]:
-    #     """Generate response using OpenAI models"""
+    @property
+    def anthropic_client(self):
+        """Anthropic client, importing the SDK the first time it is needed"""
+        if self._anthropic_client is None:
+            import anthropic
+            self._anthropic_client = anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0)
+        return self._anthropic_client
+    
+    async def generate_response(
+        self, 
+        model_id: str, 
+        conversation_history: List[Message],
+        context: Dict[str, Any] = {},
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None
+    ) -> ChatResponse:
+        """Generate AI response based on conversation history"""
         
-    #     messages = self._format_messages_for_openai(conversation_history, context)
+        start_time = time.time()
         
-    #     response = await self.openai_client.chat.completions.create(
-    #         model=model_id,
-    #         messages=messages,
-    #         temperature=temperature,
-    #         max_tokens=max_tokens
-    #     )
+        if model_id.startswith("gpt"):
+            provider = "openai"
+            generate = self._generate_openai_response
+        elif model_id.startswith("claude"):
+            provider = "anthropic"
+            generate = self._generate_anthropic_response
+        else:
+            raise ValueError(f"Unsupported model: {model_id}")
         
-    #     return {
-    #         "content": response.choices[0].message.content,
-    #         "tokens_used": response.usage.total_tokens
-    #     }
+        history = [{"role": message.role, "content": message.content} for message in conversation_history]
+        key = request_key(provider, {
+            "model": model_id,
+            "messages": history,
+            "context": context,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        })
+        
+        try:
+            # Identical concurrent requests share one provider call
+            response = await self.coordinator.submit(
+                provider,
+                key,
+                lambda: generate(model_id, conversation_history, context, temperature, max_tokens),
+                estimated_tokens=self._estimate_tokens(history, context, max_tokens),
+                tokens_used=lambda result: result["tokens_used"]
+            )
+        except ProviderOverloaded:
+            raise
+        except Exception as e:
+            raise Exception(f"AI generation failed: {str(e)}")
+        
+        response_time = time.time() - start_time
+        
+        return ChatResponse(
+            message=response["content"],
+            model_used=model_id,
+            tokens_used=response["tokens_used"],
+            response_time=response_time
+        )
     
-    # async def _generate_anthropic_response(
-    #     self, 
-    #     model_id: str, 
-    #     conversation_history: List[Message],
-    #     context: Dict[str, Any],
-    #     temperature: float,
-    #     max_tokens: Optional[int]
-    # ) -> Dict[str, Any]:
-    #     """Generate response using Anthropic models"""
+    def _estimate_tokens(
+        self,
+        history: List[Dict[str, str]],
+        context: Dict[str, Any],
+        max_tokens: Optional[int]
+    ) -> int:
+        """Rough token budget for admission control, ~4 characters per token"""
+        
+        prompt_chars = sum(len(message["content"]) for message in history)
+        prompt_chars += len(self._build_system_prompt(context))
+        return prompt_chars // 4 + (max_tokens or DEFAULT_MAX_TOKENS)
+    
+    async def _generate_openai_response(
+        self, 
+        model_id: str, 
+        conversation_history: List[Message],
+        context: Dict[str, Any],
+        temperature: float,
+        max_tokens: Optional[int]
+    ) -> Dict[str, Any]:
+        """Generate response using OpenAI models"""
         
-    #     messages = self._format_messages_for_anthropic(conversation_history, context)
+        messages = self._format_messages_for_openai(conversation_history, context)
         
-    #     response = await self.anthropic_client.messages.create(
-    #         model=model_id,
-    #         messages=messages,
-    #         temperature=temperature,
-    #         max_tokens=max_tokens or 1000
-    #     )
+        response = await self.openai_client.chat.completions.create(
+            model=model_id,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
         
-    #     return {
-    #         "content": response.content[0].text,
-    #         "tokens_used": response.usage.input_tokens + response.usage.output_tokens
-    #     }
+        return {
+            "content": response.choices[0].message.content,
+            "tokens_used": response.usage.total_tokens
+        }
     
-    # def _format_messages_for_openai(
-    #     self, 
-    #     conversation_history: List[Message], 
-    #     context: Dict[str, Any]
-    # ) -> List[Dict[str, str]]:
-    #     """Format conversation history for OpenAI API"""
+    async def _generate_anthropic_response(
+        self, 
+        model_id: str, 
+        conversation_history: List[Message],
+        context: Dict[str, Any],
+        temperature: float,
+        max_tokens: Optional[int]
+    ) -> Dict[str, Any]:
+        """Generate response using Anthropic models"""
         
-    #     system_prompt = self._build_system_prompt(context)
-    #     messages = [{"role": "system", "content": system_prompt}]
+        messages = self._format_messages_for_anthropic(conversation_history, context)
         
-    #     for message in conversation_history:
-    #         messages.append({
-    #             "role": message.role,
-    #             "content": message.content
-    #         })
+        response = await self.anthropic_client.messages.create(
+            model=model_id,
+            system=self._build_system_prompt(context),
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens or DEFAULT_MAX_TOKENS
+        )
         
-    #     return messages
+        return {
+            "content": response.content[0].text,
+            "tokens_used": response.usage.input_tokens + response.usage.output_tokens
+        }
     
-    # def _format_messages_for_anthropic(
-    #     self, 
-    #     conversation_history: List[Message], 
-    #     context: Dict[str, Any]
-    # ) -> List[Dict[str, str]]:
-    #     """Format conversation history for Anthropic API"""
+    def _format_messages_for_openai(
+        self, 
+        conversation_history: List[Message], 
+        context: Dict[str, Any]
+    ) -> List[Dict[str, str]]:
+        """Format conversation history for OpenAI API"""
+        
+        system_prompt = self._build_system_prompt(context)
+        messages = [{"role": "system", "content": system_prompt}]
+        
+        for message in conversation_history:
+            messages.append({
+                "role": message.role,
+                "content": message.content
+            })
+        
+        return messages
+    
+    def _format_messages_for_anthropic(
+        self, 
+        conversation_history: List[Message], 
+        context: Dict[str, Any]
+    ) -> List[Dict[str, str]]:
+        """Format conversation history for Anthropic API"""
         
-    #     messages = []
+        messages = []
         
-    #     for message in conversation_history:
-    #         messages.append({
-    #             "role": message.role,
-    #             "content": message.content
-    #         })
+        for message in conversation_history:
+            messages.append({
+                "role": message.role,
+                "content": message.content
+            })
         
-    #     return messages
+        return messages
     
-    # def _build_system_prompt(self, context: Dict[str, Any]) -> str:
-    #     """Build system prompt based on context"""
+    def _build_system_prompt(self, context: Dict[str, Any]) -> str:
+        """Build system prompt based on context"""
         
-    #     base_prompt = """You are an AI assistant helping with negotiation training. 
-    #     You should respond as a helpful business representative who is open to negotiation 
-    #     but also needs to maintain business interests."""
+        if context.get("persona") == "customer":
+            # Used by the negotiation simulator to play the customer side
+            base_prompt = """You are role-playing a customer in a negotiation training simulation. 
+            Negotiate firmly but politely for a better deal, keep each reply to a few sentences 
+            and stay in character."""
+        else:
+            base_prompt = """You are an AI assistant helping with negotiation training. 
+            You should respond as a helpful business representative who is open to negotiation 
+            but also needs to maintain business interests."""
         
-    #     if context.get("business_type"):
-    #         base_prompt += f"\n\nYou work in the {context['business_type']} industry."
+        if context.get("business_type"):
+            if context.get("persona") == "customer":
+                base_prompt += f"\n\nYou are buying from a business in the {context['business_type']} industry."
+            else:
+                base_prompt += f"\n\nYou work in the {context['business_type']} industry."
         
-    #     if context.get("scenario"):
-    #         base_prompt += f"\n\nScenario context: {context['scenario']}"
+        if context.get("scenario"):
+            base_prompt += f"\n\nScenario context: {context['scenario']}"
         
-    #     if context.get("intent"):
-    #         base_prompt += f"\n\nThe customer's likely intent is: {context['intent']}"
+        if context.get("intent"):
+            if context.get("persona") == "customer":
+                base_prompt += f"\n\nYour goal is: {context['intent']}"
+            else:
+                base_prompt += f"\n\nThe customer's likely intent is: {context['intent']}"
         
-    #     return base_prompt
+        return base_prompt
     
     # async def analyze_conversation(self, conversation_history: List[Message]) -> Dict[str, Any]:
     #     """Analyze conversation for insights and training data"""
@@ -0,0 +1,340 @@
+"""
+Change feed for dataset mutations
+
+Every create, update and delete on a record store is published here with a
+monotonically increasing sequence number. Subscribers get their own bounded
+queue; recent events are kept in a ring buffer so a client that reconnects
+with the last sequence it saw can resume without refetching the datasets.
+
+With several workers the feed is driven by a ``ChangeLog``, an append-only
+file in the datasets directory. Writes append their events while still
+holding the dataset's lock, and every worker tails the file, so each
+subscriber sees every worker's changes under one stream id and sequence.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from services.serialization import dumps, loads
+from services.storage import FileLock, atomic_write
+
+logger = logging.getLogger(__name__)
+
+# (first sequence the log was trimmed to, offset) of the next unread byte of a change log
+LogPosition = Tuple[int, int]
+
+
+class Subscription:
+    """A subscriber's queue of pending events"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_pending: int):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.lagged = False
+        self.start_seq = 0
+
+    def _deliver(self, event: Dict[str, Any]) -> None:
+        # Runs on the subscriber's loop
+        if self.lagged:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The client fell too far behind; it must reconnect and resume
+            self.lagged = True
+
+    async def next_event(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Wait for the next event, or ``None`` when ``timeout`` expires"""
+
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class ChangeLog:
+    """Append-only file of change events shared by every worker
+
+    The first line holds the stream id and the sequence the log was last
+    trimmed to. Events are appended under an exclusive lock on ``<log>.lock``
+    and numbered by its generation counter. Every ``max_events`` appends the
+    file is rewritten with only the newest ``max_events`` events, and readers
+    that see a new trim point start over.
+    """
+
+    def __init__(self, path_factory: Callable[[], Path], max_events: int = 1000):
+        self.path_factory = path_factory
+        self.max_events = max_events
+        self._file_lock: Optional[Tuple[Path, FileLock]] = None
+        self._lock = threading.Lock()
+
+    def _open(self) -> Tuple[Path, FileLock]:
+        path = Path(self.path_factory())
+        if self._file_lock is None or self._file_lock[0] != path:
+            if self._file_lock is not None:
+                self._file_lock[1].close()
+            self._file_lock = (path, FileLock(path.with_name(path.name + ".lock")))
+        return self._file_lock
+
+    @staticmethod
+    def _create_if_missing(path: Path) -> None:
+        """Start a new stream; the caller must hold the exclusive lock"""
+
+        if not path.exists():
+            atomic_write(path, dumps({"stream_id": uuid.uuid4().hex, "start": 0}) + b"\n")
+
+    def append(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Number ``event`` and append it to the log"""
+
+        with self._lock:
+            path, lock = self._open()
+            with lock.exclusive():
+                self._create_if_missing(path)
+                event["seq"] = lock.bump()
+                with open(path, "ab") as f:
+                    f.write(dumps(event) + b"\n")
+                if event["seq"] % self.max_events == 0:
+                    self._compact(path, event["seq"] - self.max_events)
+        return event
+
+    def _compact(self, path: Path, keep_after: int) -> None:
+        lines = path.read_bytes().splitlines(keepends=True)
+        header = dict(loads(lines[0]), start=keep_after)
+        kept = [line for line in lines[1:] if loads(line)["seq"] > keep_after]
+        atomic_write(path, b"".join([dumps(header) + b"\n"] + kept))
+
+    def read(self, position: Optional[LogPosition]) -> Tuple[Optional[str], List[Dict[str, Any]], LogPosition]:
+        """Read the events written since ``position``
+
+        Returns the stream id when the log was read from its start (the first
+        read, or after the file was compacted or recreated) and ``None``
+        otherwise, the events, and the position to read from next.
+        """
+
+        with self._lock:
+            path, lock = self._open()
+            if not path.exists():
+                with lock.exclusive():
+                    self._create_if_missing(path)
+        with open(path, "rb") as f:
+            header = loads(f.readline())
+            stream_id = None
+            if position is None or position[0] != header["start"] or position[1] > os.fstat(f.fileno()).st_size:
+                stream_id = header["stream_id"]
+            else:
+                f.seek(position[1])
+            data = f.read()
+            # A line without its newline is still being appended
+            complete = data[:data.rfind(b"\n") + 1]
+            events = [loads(line) for line in complete.splitlines()]
+            return stream_id, events, (header["start"], f.tell() - len(data) + len(complete))
+
+
+class ChangeFeed:
+    """Sequenced pub/sub of dataset changes with a bounded replay history
+
+    Without a ``log`` the feed only carries changes made by this process.
+    """
+
+    def __init__(self, history_size: int = 1000, max_pending: int = 1000,
+                 log: Optional[ChangeLog] = None, poll_interval: float = 0.2):
+        self.max_pending = max_pending
+        self.log = log
+        self.poll_interval = poll_interval
+        self._stream_id = None if log is not None else uuid.uuid4().hex
+        self._position: Optional[LogPosition] = None
+        self._poller: Optional[threading.Thread] = None
+        self._sequence = 0
+        self._history: Deque[Dict[str, Any]] = deque(maxlen=history_size)
+        self._subscribers: Set[Subscription] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def stream_id(self) -> str:
+        if self._stream_id is None:
+            with self._lock:
+                self._poll()
+        return self._stream_id
+
+    def _fan_out(self, event: Dict[str, Any]) -> None:
+        for subscription in self._subscribers:
+            subscription.loop.call_soon_threadsafe(subscription._deliver, event)
+
+    def _record(self, event: Dict[str, Any]) -> None:
+        self._sequence = event["seq"]
+        self._history.append(event)
+        self._fan_out(event)
+
+    def _reset(self) -> None:
+        """Tell subscribers they missed events; only new events are replayed from here"""
+
+        self._history.clear()
+        self._fan_out(self._event(self._sequence, None, "reset", None, None, None))
+
+    @staticmethod
+    def _event(seq: Optional[int], dataset: Optional[str], action: str, record_id: Optional[str],
+               record: Optional[Dict[str, Any]], user_id: Optional[str]) -> Dict[str, Any]:
+        return {
+            "seq": seq,
+            "dataset": dataset,
+            "user_id": user_id,
+            "action": action,
+            "id": record_id,
+            "record": record,
+            "timestamp": datetime.now().isoformat(),
+        }
+
+    def _poll(self) -> None:
+        """Take in events other workers appended to the log; caller holds ``_lock``"""
+
+        stream_id, events, self._position = self.log.read(self._position)
+        if stream_id is not None and stream_id != self._stream_id:
+            # The log was recreated, so the old sequence numbers mean nothing
+            first_read = self._stream_id is None
+            self._stream_id, self._sequence = stream_id, 0
+            if not first_read:
+                self._reset()
+        events = [event for event in events if event["seq"] > self._sequence]
+        if events and self._sequence and events[0]["seq"] > self._sequence + 1:
+            # The log was compacted past events this worker had not read yet
+            self._reset()
+        for event in events:
+            self._record(event)
+
+    def _poll_forever(self) -> None:
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                if not self._subscribers:
+                    continue
+                try:
+                    self._poll()
+                except (OSError, ValueError):
+                    logger.exception("Could not read the change log")
+
+    def publish(self, dataset: Optional[str], action: str, record_id: Optional[str],
+                record: Optional[Dict[str, Any]] = None,
+                user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Record a change and fan it out to every subscriber
+
+        ``action="reset"`` tells every subscriber to refetch the datasets.
+        """
+
+        if self.log is not None:
+            event = self.log.append(self._event(None, dataset, action, record_id, record, user_id))
+            with self._lock:
+                self._poll()
+            return event
+        with self._lock:
+            event = self._event(self._sequence + 1, dataset, action, record_id, record, user_id)
+            self._record(event)
+        return event
+
+    def subscribe(self, since: Optional[int] = None) -> Tuple[Subscription, List[Dict[str, Any]], bool]:
+        """Register a subscriber and return the events it missed
+
+        Returns the subscription, the backlog after ``since`` and whether the
+        backlog is complete. An incomplete backlog means the client must
+        refetch the datasets before applying live events.
+        """
+
+        subscription = Subscription(asyncio.get_running_loop(), self.max_pending)
+        with self._lock:
+            if self.log is not None:
+                self._poll()
+                if self._poller is None:
+                    self._poller = threading.Thread(target=self._poll_forever,
+                                                    name="change-feed-poll", daemon=True)
+                    self._poller.start()
+            self._subscribers.add(subscription)
+            subscription.start_seq = self._sequence
+            if since is None:
+                return subscription, [], True
+            if since > self._sequence:
+                # The client saw a sequence from before a server restart
+                return subscription, [], False
+            backlog = [event for event in self._history if event["seq"] > since]
+            oldest = self._history[0]["seq"] if self._history else self._sequence + 1
+            complete = since >= oldest - 1
+            return subscription, backlog, complete
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+
+def format_sse(event: str, data: Any, event_id: Optional[str] = None) -> bytes:
+    """Encode one server-sent event"""
+
+    message = b""
+    if event_id is not None:
+        message += f"id: {event_id}\n".encode()
+    return message + f"event: {event}\n".encode() + b"data: " + dumps(data) + b"\n\n"
+
+
+def parse_event_id(value: Optional[str], stream_id: str) -> Tuple[Optional[int], bool]:
+    """Parse a ``Last-Event-ID`` of the form ``<stream_id>:<seq>``
+
+    Returns the sequence to resume from and whether it belongs to this
+    stream. Ids from another stream come from before a server restart.
+    """
+
+    if not value:
+        return None, True
+    stream, _, seq = value.rpartition(":")
+    if stream != stream_id or not seq.isdigit():
+        return None, False
+    return int(seq), True
+
+
+def _format_event(feed: ChangeFeed, event: Dict[str, Any]) -> bytes:
+    event_id = f"{feed.stream_id}:{event['seq']}"
+    if event["action"] == "reset":
+        return format_sse("reset", {"stream_id": feed.stream_id, "seq": event["seq"]}, event_id)
+    return format_sse("change", event, event_id)
+
+
+async def event_stream(feed: ChangeFeed, since: Optional[int], resumable: bool = True,
+                       heartbeat: float = 15.0,
+                       user_id: Optional[str] = None) -> AsyncIterator[bytes]:
+    """Yield server-sent events for ``feed``, starting after ``since``
+
+    With ``user_id`` set only that user's changes, and resets, are sent.
+
+    A ``reset`` event tells the client that events were missed and it must
+    refetch the datasets. If the subscriber's queue overflows the stream ends
+    and the client's reconnect resumes from the history buffer.
+    """
+
+    subscription, backlog, complete = feed.subscribe(since)
+    try:
+        # Tag the preamble with the current sequence so a reconnect resumes from
+        # here even if no change was delivered before the connection dropped
+        current = subscription.start_seq
+        resume_from = since if since is not None and complete and resumable else current
+        yield format_sse("hello", {"stream_id": feed.stream_id, "seq": current},
+                         f"{feed.stream_id}:{resume_from}")
+        if not (complete and resumable):
+            yield format_sse("reset", {"stream_id": feed.stream_id, "seq": current})
+        for event in backlog:
+            if user_id is None or event["user_id"] in (user_id, None):
+                yield _format_event(feed, event)
+        while True:
+            event = await subscription.next_event(heartbeat)
+            if subscription.lagged:
+                break
+            if event is None:
+                yield b": keepalive\n\n"
+                continue
+            if user_id is None or event["user_id"] in (user_id, None):
+                yield _format_event(feed, event)
+    finally:
+        feed.unsubscribe(subscription)
@@ -0,0 +1,416 @@
+"""
+Near-duplicate detection for dataset rows
+
+Rows are compared on their ``customer_message`` and ``business_response``
+text. Each row gets a MinHash signature over character shingles of the
+normalised text, and an LSH index buckets signatures by band so a lookup only
+compares a row against the few rows that share a band with it, rather than
+against every row in the dataset.
+
+``StoreIndex`` keeps an index in sync with one user's ``table_data`` store and
+screens new rows on write. Building an index hashes every row, so
+``DedupIndexes.warm`` builds them on a background thread at startup. ``python -m services.dedup`` runs an offline pass
+over an existing dataset, hashing on all cores:
+
+    python -m services.dedup --all-users            # report only
+    python -m services.dedup --all-users --apply    # delete near-duplicates
+"""
+
+import argparse
+import operator
+import random
+import re
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from services.storage import RecordStore, Version
+
+_MASK_64 = (1 << 64) - 1
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+DEDUP_MODES = ("off", "flag", "reject")
+
+# A signature is one 32-bit value per permutation
+Signature = array
+Match = Tuple[str, float]
+
+
+def entry_text(data: Any) -> str:
+    """Text a row is compared on, from a dict or a record"""
+
+    get = data.get
+    return f"{get('customer_message') or ''}\n{get('business_response') or ''}"
+
+
+def normalise(text: str) -> str:
+    """Lowercase and reduce punctuation and whitespace runs to single spaces"""
+
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+
+class MinHasher:
+    """MinHash signatures over character shingles
+
+    Each permutation is a multiply-add-shift hash, the top 32 bits of
+    ``(a * h + b) mod 2**64`` for the 32-bit shingle hash ``h``. numpy's uint64
+    arithmetic wraps the same way, so both paths give identical signatures.
+    """
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = random.Random(seed)
+        self._a = [rng.getrandbits(64) | 1 for _ in range(num_perm)]
+        self._b = [rng.getrandbits(64) for _ in range(num_perm)]
+        self._arrays: Optional[tuple] = None
+
+    def _numpy_arrays(self) -> tuple:
+        """``(numpy, a, b)``, or ``()`` without numpy; imported on first use to keep startup light"""
+
+        if self._arrays is None:
+            try:
+                import numpy
+            except ImportError:
+                # Same signatures in pure Python, only slower
+                self._arrays = ()
+            else:
+                self._arrays = (
+                    numpy,
+                    numpy.array(self._a, dtype=numpy.uint64),
+                    numpy.array(self._b, dtype=numpy.uint64),
+                )
+        return self._arrays
+
+    def shingle_hashes(self, text: str) -> List[int]:
+        text = normalise(text)
+        k = self.shingle_size
+        if len(text) <= k:
+            shingles = {text} if text else set()
+        else:
+            shingles = {text[i:i + k] for i in range(len(text) - k + 1)}
+        # crc32 is stable across processes, unlike hash()
+        return [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles]
+
+    def signature(self, text: str) -> Optional[Signature]:
+        """Signature of ``text``, or ``None`` if it has no content to compare"""
+
+        hashes = self.shingle_hashes(text)
+        if not hashes:
+            return None
+        arrays = self._numpy_arrays()
+        if arrays:
+            numpy, a, b = arrays
+            values = numpy.array(hashes, dtype=numpy.uint64)
+            permuted = numpy.outer(values, a) + b
+            return array("I", (permuted.min(axis=0) >> numpy.uint64(32)).astype(numpy.uint32).tobytes())
+        # The shift is monotonic, so it can be applied after taking the minimum
+        return array("I", [
+            min([(a * h + b) & _MASK_64 for h in hashes]) >> 32 for a, b in zip(self._a, self._b)
+        ])
+
+
+def similarity(first: Signature, second: Signature) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+
+    return sum(map(operator.eq, first, second)) / len(first)
+
+
+class LSHIndex:
+    """Banded LSH over MinHash signatures
+
+    With ``bands`` bands of ``num_perm / bands`` rows, pairs at the default
+    0.85 similarity share a band with probability above 0.99, while pairs
+    below 0.5 rarely do. Candidates are then checked against the threshold
+    with their full signatures.
+    """
+
+    def __init__(self, num_perm: int = 128, bands: int = 16, threshold: float = 0.85):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self._buckets: Dict[Tuple[int, int], List[str]] = {}
+        self._signatures: Dict[str, Signature] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, record_id: str) -> bool:
+        return record_id in self._signatures
+
+    def ids(self) -> Iterable[str]:
+        return self._signatures.keys()
+
+    def band_keys(self, signature: Signature) -> List[Tuple[int, int]]:
+        raw = signature.tobytes()
+        width = self.rows * signature.itemsize
+        return [(band, hash(raw[band * width:(band + 1) * width])) for band in range(self.bands)]
+
+    def add(self, record_id: str, signature: Signature,
+            band_keys: Optional[List[Tuple[int, int]]] = None) -> None:
+        if record_id in self._signatures:
+            self.remove(record_id)
+        self._signatures[record_id] = signature
+        for key in band_keys or self.band_keys(signature):
+            self._buckets.setdefault(key, []).append(record_id)
+
+    def remove(self, record_id: str) -> None:
+        signature = self._signatures.pop(record_id, None)
+        if signature is None:
+            return
+        for key in self.band_keys(signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.remove(record_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def query(self, signature: Signature,
+              band_keys: Optional[List[Tuple[int, int]]] = None) -> List[Match]:
+        """Indexed rows at or above the threshold, most similar first"""
+
+        candidates = set()
+        for key in band_keys or self.band_keys(signature):
+            candidates.update(self._buckets.get(key, ()))
+        matches = []
+        for record_id in candidates:
+            score = similarity(signature, self._signatures[record_id])
+            if score >= self.threshold:
+                matches.append((record_id, round(score, 3)))
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches
+
+
+class StoreIndex:
+    """An LSH index kept in sync with one ``table_data`` store"""
+
+    def __init__(self, store: RecordStore, hasher: MinHasher, bands: int = 16, threshold: float = 0.85):
+        self.store = store
+        self.hasher = hasher
+        self.index = LSHIndex(hasher.num_perm, bands, threshold)
+        self._version: Optional[Version] = None
+        self._lock = threading.Lock()
+
+    def _sync(self) -> None:
+        """Index rows written by other processes and drop deleted ones"""
+
+        version = self.store.version()
+        if version == self._version:
+            return
+        records = self.store.records()
+        present = {}
+        for record in records:
+            record_id = record.get("id")
+            if record_id and (record.get("customer_message") or record.get("business_response")):
+                present[record_id] = record
+        for record_id in [record_id for record_id in self.index.ids() if record_id not in present]:
+            self.index.remove(record_id)
+        for record_id, record in present.items():
+            if record_id not in self.index:
+                signature = self.hasher.signature(entry_text(record))
+                if signature is not None:
+                    self.index.add(record_id, signature)
+        self._version = version
+
+    def screen(self, rows: List[Dict[str, Any]], mode: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Check rows against the index and each other before they are written
+
+        Returns the rows to write and a report for each rejected row. In
+        ``flag`` mode near-duplicates are kept with ``near_duplicate_of`` and
+        ``similarity`` added to their metadata. Accepted rows are indexed right
+        away; call ``committed`` after the write or ``invalidate`` if it fails.
+        """
+
+        if mode == "off":
+            return rows, []
+        accepted, rejected = [], []
+        with self._lock:
+            self._sync()
+            for row in rows:
+                signature = self.hasher.signature(entry_text(row))
+                if signature is None:
+                    accepted.append(row)
+                    continue
+                band_keys = self.index.band_keys(signature)
+                matches = self.index.query(signature, band_keys)
+                if matches and mode == "reject":
+                    rejected.append({"id": row.get("id"), "duplicates": [
+                        {"id": record_id, "similarity": score} for record_id, score in matches[:5]
+                    ]})
+                    continue
+                if matches:
+                    row["metadata"] = dict(row.get("metadata") or {},
+                                           near_duplicate_of=matches[0][0], similarity=matches[0][1])
+                self.index.add(row["id"], signature, band_keys)
+                accepted.append(row)
+        return accepted, rejected
+
+    def warm(self) -> None:
+        """Build the index now so the next write does not have to"""
+
+        with self._lock:
+            self._sync()
+
+    def committed(self) -> None:
+        """Record the store version after a write, skipping a resync when it was ours alone"""
+
+        with self._lock:
+            if self._version is None:
+                return
+            version = self.store.version()
+            if version[2] == self._version[2] + 1:
+                self._version = version
+            else:
+                self._version = None
+
+    def invalidate(self) -> None:
+        """Force a resync, e.g. after a write that failed"""
+
+        with self._lock:
+            self._version = None
+
+
+class DedupIndexes:
+    """One ``StoreIndex`` per user, the least recently used ones dropped first"""
+
+    def __init__(self, store_for_user: Callable[[str], RecordStore], threshold: float = 0.85,
+                 num_perm: int = 128, bands: int = 16, max_indexes: int = 64):
+        self.store_for_user = store_for_user
+        self.hasher = MinHasher(num_perm)
+        self.threshold = threshold
+        self.bands = bands
+        self.max_indexes = max_indexes
+        self._indexes: "OrderedDict[str, StoreIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._warmer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dedup-warm")
+
+    def index(self, user_id: str) -> StoreIndex:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            store = self.store_for_user(user_id)
+            # The shard cache may have reopened the store since the index was built
+            if index is None or index.store is not store:
+                index = StoreIndex(store, self.hasher, self.bands, self.threshold)
+                self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+            return index
+
+    def warm(self, user_ids: Iterable[str]) -> Future:
+        """Build the indexes for ``user_ids`` on a background thread"""
+
+        user_ids = list(user_ids)[:self.max_indexes]
+
+        def build():
+            for user_id in user_ids:
+                self.index(user_id).warm()
+
+        return self._warmer.submit(build)
+
+
+_worker_hasher: Optional[MinHasher] = None
+
+
+def _init_worker(num_perm: int, shingle_size: int, seed: int) -> None:
+    global _worker_hasher
+    _worker_hasher = MinHasher(num_perm, shingle_size, seed)
+
+
+def _signature_bytes(texts: Sequence[str]) -> List[Optional[bytes]]:
+    signatures = (_worker_hasher.signature(text) for text in texts)
+    return [signature.tobytes() if signature is not None else None for signature in signatures]
+
+
+def find_near_duplicates(records: Sequence[Any], hasher: MinHasher, bands: int = 16,
+                         threshold: float = 0.85, workers: Optional[int] = None,
+                         chunk_size: int = 2000) -> List[Tuple[str, str, float]]:
+    """Return ``(duplicate_id, kept_id, similarity)`` for every near-duplicate row
+
+    Signatures are computed in a process pool; the first occurrence of each
+    group is kept, in file order.
+    """
+
+    rows = [(record.get("id"), entry_text(record)) for record in records
+            if record.get("id") and (record.get("customer_message") or record.get("business_response"))]
+    chunks = [[text for _, text in rows[i:i + chunk_size]] for i in range(0, len(rows), chunk_size)]
+    index = LSHIndex(hasher.num_perm, bands, threshold)
+    duplicates = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(hasher.num_perm, hasher.shingle_size, hasher.seed)) as pool:
+        position = 0
+        # map yields chunks in order, so earlier rows are always indexed first
+        for signatures in pool.map(_signature_bytes, chunks):
+            for raw in signatures:
+                record_id = rows[position][0]
+                position += 1
+                if raw is None:
+                    continue
+                signature = array("I")
+                signature.frombytes(raw)
+                band_keys = index.band_keys(signature)
+                matches = index.query(signature, band_keys)
+                if matches:
+                    duplicates.append((record_id, matches[0][0], matches[0][1]))
+                else:
+                    index.add(record_id, signature, band_keys)
+    return duplicates
+
+
+def main():
+    from models.records import DatasetRecord
+    from services.change_feed import ChangeFeed, ChangeLog
+    from services.sharding import DEFAULT_USER, ShardedStore
+
+    parser = argparse.ArgumentParser(description="Find and remove near-duplicate dataset rows")
+    parser.add_argument("--datasets-dir", type=Path, default=Path.home() / "Documents" / "datasets")
+    parser.add_argument("--user-id", default=DEFAULT_USER)
+    parser.add_argument("--all-users", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.85)
+    parser.add_argument("--num-perm", type=int, default=128)
+    parser.add_argument("--bands", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=None, help="defaults to every core")
+    parser.add_argument("--apply", action="store_true", help="delete the duplicates found")
+    args = parser.parse_args()
+
+    # Publish --apply deletions to /api/changes subscribers of running workers
+    change_feed = ChangeFeed(log=ChangeLog(lambda: args.datasets_dir / "changes.log"))
+    dataset_store = ShardedStore(
+        lambda: args.datasets_dir,
+        {"table_data": ("table_data.json", DatasetRecord)},
+        on_change=lambda user_id, dataset, action, record_id, record: change_feed.publish(
+            dataset, action, record_id, record, user_id=user_id),
+    )
+    hasher = MinHasher(args.num_perm)
+    users = dataset_store.users() if args.all_users else [args.user_id]
+
+    total_rows = total_duplicates = 0
+    for user_id in users:
+        store = dataset_store.store(user_id, "table_data")
+        records = store.records()
+        duplicates = find_near_duplicates(records, hasher, args.bands, args.threshold, args.workers)
+        total_rows += len(records)
+        total_duplicates += len(duplicates)
+        print(f"{user_id}: {len(records)} rows, {len(duplicates)} near-duplicates")
+        for duplicate_id, kept_id, score in duplicates[:5]:
+            print(f"  {duplicate_id} ~ {kept_id} ({score})")
+        if args.apply and duplicates:
+            # delete_many only removes these ids, so concurrent writes are kept
+            removed = store.delete_many({duplicate_id for duplicate_id, _, _ in duplicates})
+            print(f"  removed {removed}")
+
+    print(f"total: {total_rows} rows, {total_duplicates} near-duplicates"
+          + ("" if args.apply else " (dry run, pass --apply to delete)"))
+
+
+if __name__ == "__main__":
+    main()
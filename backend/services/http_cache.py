@@ -0,0 +1,168 @@
+"""
+Conditional GET and compression for dataset responses
+
+Dataset endpoints are versioned by their file's mtime, size and write
+generation, which the store's write path keeps current, so ``If-None-Match`` and
+``If-Modified-Since`` are answered from a ``stat`` without reading the file.
+Only ``If-Modified-Since`` dates strictly after the mtime's second get a 304;
+clients that need 304s within the same second should send the ETag.
+Compressed bodies are cached per version, so repeated polls of an unchanged
+dataset do not compress it again.
+"""
+
+import gzip
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Callable, Dict, Optional, Tuple
+
+from fastapi import Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response
+
+from services.storage import RecordStore, Version
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+_compressors: Dict[str, Callable[[bytes], bytes]] = {
+    "gzip": lambda body: gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0),
+}
+if brotli is not None:
+    _compressors["br"] = lambda body: brotli.compress(body, quality=BROTLI_QUALITY)
+
+
+def make_etag(version: Version) -> str:
+    mtime_ns, size, generation = version
+    return f'W/"{generation:x}-{mtime_ns:x}-{size:x}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: ignore the W/ prefix on both sides
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def _not_modified_since(if_modified_since: str, mtime_ns: int) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    # HTTP dates have one-second resolution, so a date equal to the mtime's
+    # second cannot tell whether a later write in that same second was seen
+    return mtime_ns // 1_000_000_000 < int(since.timestamp())
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick the best encoding the client accepts, preferring brotli"""
+
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip())
+    for encoding in ("br", "gzip"):
+        if encoding in _compressors and (encoding in accepted or "*" in accepted):
+            return encoding
+    return None
+
+
+class CompressionCache:
+    """Compressed bodies for the current version of recently served stores"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[RecordStore, Version, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, store: RecordStore, version: Version, body: bytes,
+            encoding: str) -> bytes:
+        key = (id(store), encoding)
+        with self._lock:
+            cached = self._entries.get(key)
+            # Entries keep their store alive, so the id cannot be reused meanwhile
+            if cached is not None and cached[0] is store and cached[1] == version:
+                self._entries.move_to_end(key)
+                return cached[2]
+        compressed = _compressors[encoding](body)
+        with self._lock:
+            self._entries[key] = (store, version, compressed)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return compressed
+
+
+compression_cache = CompressionCache()
+
+
+def _validator_headers(version: Version) -> Dict[str, str]:
+    return {
+        "ETag": make_etag(version),
+        "Last-Modified": formatdate(version[0] / 1_000_000_000, usegmt=True),
+        "Cache-Control": "no-cache",
+        # The body is the requesting user's shard
+        "Vary": "Accept-Encoding, X-User-Id",
+    }
+
+
+def conditional_response(request: Request, store: RecordStore,
+                         minimum_size: int = 1024) -> Response:
+    """Serve a store's body with validators, 304s and cached compression"""
+
+    version = store.version()
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, make_etag(version)):
+            return Response(status_code=304, headers=_validator_headers(version))
+    elif "if-modified-since" in request.headers:
+        if _not_modified_since(request.headers["if-modified-since"], version[0]):
+            return Response(status_code=304, headers=_validator_headers(version))
+
+    version, body = store.versioned_body()
+    headers = _validator_headers(version)
+
+    if len(body) >= minimum_size:
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+        if encoding is not None:
+            body = compression_cache.get(store, version, body, encoding)
+            headers["Content-Encoding"] = encoding
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that leaves streaming endpoints alone
+
+    Starlette's gzip responder buffers a streaming body until its compressor
+    flushes, which would hold back server-sent events.
+    """
+
+    def __init__(self, app, excluded_paths: Tuple[str, ...] = (), **kwargs):
+        super().__init__(app, **kwargs)
+        self.excluded_paths = excluded_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(self.excluded_paths):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
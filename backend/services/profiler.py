@@ -0,0 +1,267 @@
+"""
+Opt-in request profiling for the API
+
+The middleware is only installed when profiling is enabled, so a disabled
+profiler adds no per-request work at all. When installed, a request is
+profiled if it carries the trigger header or falls into the sample rate.
+
+cProfile hooks the event loop's thread, and the request awaits while it is
+enabled, so a profile also contains whatever other requests ran on the loop
+in the meantime. Profile under low concurrency for a clean picture.
+
+Sync endpoints run in the threadpool, which a profile of the loop thread does
+not see. Routes built with ``ProfiledRoute`` run a profiled request's sync
+endpoint under a second profiler in its worker thread, and the two are saved
+as one capture. A capture of a sync endpoint that was not profiled that way
+says so in its ``note``.
+"""
+
+import asyncio
+import cProfile
+import functools
+import io
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+
+from services.serialization import dumps, loads
+from services.storage import atomic_write
+
+PROFILE_HEADER = b"x-profile"
+
+
+class ProfileStore:
+    """Captured profiles on disk, each with a JSON sidecar describing its request
+
+    The directory is the index: every worker lists the same captures, and the
+    ``max_profiles`` cap holds across workers and restarts. File names start
+    with the capture time, so sorting them sorts the captures by age.
+    """
+
+    def __init__(self, profile_dir: Path, max_profiles: int = 200):
+        self.profile_dir = Path(profile_dir)
+        self.max_profiles = max_profiles
+
+    def save(self, profile: Union[cProfile.Profile, pstats.Stats], method: str, path: str,
+             route: str, duration_ms: float, status_code: Optional[int],
+             note: Optional[str] = None) -> Dict[str, Any]:
+        """Dump a finished profile with its sidecar and evict the oldest captures"""
+
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.now()
+        route_tag = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        # The pid keeps captures made by two workers in the same microsecond apart
+        profile_id = f"{timestamp.strftime('%Y%m%d_%H%M%S_%f')}_{os.getpid()}_{method}_{route_tag}"
+        file_path = self.profile_dir / f"{profile_id}.prof"
+        profile.dump_stats(str(file_path))
+
+        entry = {
+            "id": profile_id,
+            "method": method,
+            "path": path,
+            "route": route,
+            "status_code": status_code,
+            "duration_ms": round(duration_ms, 3),
+            "captured_at": timestamp.isoformat(),
+            "file": str(file_path),
+            "note": note,
+        }
+        atomic_write(file_path.with_suffix(".json"), dumps(entry))
+        self._evict()
+        return entry
+
+    def _evict(self) -> None:
+        """Delete all but the newest ``max_profiles`` captures, sidecars included"""
+
+        captures = sorted(self.profile_dir.glob("*.prof"))
+        for file_path in captures[:max(0, len(captures) - self.max_profiles)]:
+            file_path.unlink(missing_ok=True)
+            file_path.with_suffix(".json").unlink(missing_ok=True)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Every capture with a sidecar, oldest first"""
+
+        entries = []
+        for sidecar in sorted(self.profile_dir.glob("*.json")):
+            try:
+                entries.append(loads(sidecar.read_bytes()))
+            except FileNotFoundError:
+                # Evicted by another worker since the directory was listed
+                continue
+        return entries
+
+    def slowest(self, limit: int = 20, route: Optional[str] = None,
+                top_functions: int = 10) -> List[Dict[str, Any]]:
+        """Return the slowest captured requests with their hottest functions"""
+
+        entries = self.entries()
+        if route:
+            entries = [entry for entry in entries if entry["route"] == route]
+
+        entries.sort(key=lambda entry: entry["duration_ms"], reverse=True)
+
+        results = []
+        for entry in entries[:limit]:
+            result = dict(entry)
+            result["top_functions"] = self._top_functions(entry["file"], top_functions)
+            results.append(result)
+        return results
+
+    def _top_functions(self, file_path: str, limit: int) -> List[Dict[str, Any]]:
+        """Summarise a saved profile by time spent in each function itself
+
+        Cumulative time would rank the framework's middleware and routing
+        wrappers first, since every request passes through them.
+        """
+
+        if not Path(file_path).exists():
+            return []
+
+        stats = pstats.Stats(file_path, stream=io.StringIO())
+        rows = []
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            rows.append({
+                "function": f"{filename}:{line}({name})",
+                "calls": calls,
+                "tottime_ms": round(tottime * 1000, 3),
+                "cumtime_ms": round(cumtime * 1000, 3),
+            })
+        rows.sort(key=lambda row: row["tottime_ms"], reverse=True)
+        return rows[:limit]
+
+
+class ThreadCapture:
+    """Profile of the threadpool work done for one profiled request"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def run(self, func: Callable, *args, **kwargs) -> Any:
+        # A profiler may only be enabled on one thread at a time
+        with self._lock:
+            self.calls += 1
+            return self.profile.runcall(func, *args, **kwargs)
+
+
+# Set by the middleware for a profiled request; copied into its worker threads
+_thread_capture: ContextVar[Optional[ThreadCapture]] = ContextVar("profiling_thread_capture", default=None)
+
+
+def profile_in_worker_thread(func: Callable) -> Callable:
+    """Wrap a sync endpoint so a profiled request also profiles its worker thread"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        capture = _thread_capture.get()
+        if capture is None:
+            return func(*args, **kwargs)
+        return capture.run(func, *args, **kwargs)
+
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """Route whose sync endpoint is profiled in the worker thread it runs on"""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        if not asyncio.iscoroutinefunction(endpoint):
+            endpoint = profile_in_worker_thread(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles sampled or explicitly requested calls"""
+
+    def __init__(self, app, store: ProfileStore, sample_rate: float = 0.0,
+                 path_prefix: str = "/api/", allow_header: bool = True):
+        self.app = app
+        self.store = store
+        self.sample_rate = sample_rate
+        self.path_prefix = path_prefix
+        self.allow_header = allow_header
+        # cProfile hooks the whole thread, so only one request is profiled at a time
+        self._active = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        if not self._should_profile(scope) or not self._active.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        status_code = None
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        profile = cProfile.Profile()
+        capture = ThreadCapture()
+        token = _thread_capture.set(capture)
+        start_time = time.perf_counter()
+        try:
+            profile.enable()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                profile.disable()
+                _thread_capture.reset(token)
+            duration_ms = (time.perf_counter() - start_time) * 1000
+
+            stats = pstats.Stats(profile, stream=io.StringIO())
+            note = None
+            if capture.calls:
+                stats.add(capture.profile)
+            elif self._runs_in_threadpool(scope):
+                note = "sync endpoint ran in the threadpool without ProfiledRoute; its work is not in this profile"
+            # Writing the profile file would otherwise block the event loop
+            await run_in_threadpool(
+                self.store.save,
+                stats,
+                method=scope["method"],
+                path=scope["path"],
+                route=self._route_tag(scope),
+                duration_ms=duration_ms,
+                status_code=status_code,
+                note=note,
+            )
+        finally:
+            self._active.release()
+
+    @staticmethod
+    def _runs_in_threadpool(scope) -> bool:
+        endpoint = scope.get("endpoint")
+        return endpoint is not None and not asyncio.iscoroutinefunction(endpoint)
+
+    def _should_profile(self, scope) -> bool:
+        if self.allow_header:
+            for name, value in scope.get("headers", []):
+                if name == PROFILE_HEADER:
+                    return value.strip() in (b"1", b"true", b"yes")
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @staticmethod
+    def _route_tag(scope) -> str:
+        route = scope.get("route")
+        if route is not None and getattr(route, "path", None):
+            return route.path
+        endpoint = scope.get("endpoint")
+        if endpoint is not None:
+            return endpoint.__name__
+        return scope["path"]
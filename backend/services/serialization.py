@@ -0,0 +1,95 @@
+"""
+JSON serialization used for HTTP responses and dataset files
+
+orjson is preferred, then msgspec, with the standard library as a fallback.
+All backends produce compact UTF-8 bytes so responses and on-disk files are
+encoded the same way.
+"""
+
+import dataclasses
+import json
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Tuple
+from uuid import UUID
+
+from fastapi.responses import Response
+
+
+def _default(obj: Any) -> Any:
+    """Encode the few non-JSON types our records may contain"""
+
+    if isinstance(obj, datetime) and obj.utcoffset() == timedelta(0):
+        # UTC is written as Z, as orjson (with OPT_UTC_Z) and msgspec do
+        return obj.replace(tzinfo=None).isoformat() + "Z"
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, UUID):
+        return str(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+Backend = Tuple[str, Callable[[Any], bytes], Callable[[Any], Any]]
+
+
+def _orjson_backend() -> Backend:
+    import orjson
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_UTC_Z)
+
+    return "orjson", dumps, orjson.loads
+
+
+def _msgspec_backend() -> Backend:
+    import msgspec
+
+    encoder = msgspec.json.Encoder(enc_hook=_default)
+    decoder = msgspec.json.Decoder()
+    return "msgspec", encoder.encode, decoder.decode
+
+
+def _json_backend() -> Backend:
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(
+            obj, default=_default, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+
+    return "json", dumps, json.loads
+
+
+def _select_backend() -> Backend:
+    for backend in (_orjson_backend, _msgspec_backend):
+        try:
+            return backend()
+        except ImportError:
+            pass
+    return _json_backend()
+
+
+BACKEND, dumps, loads = _select_backend()
+
+
+def read_json(path: Path) -> Any:
+    """Load a JSON document from disk"""
+    return loads(Path(path).read_bytes())
+
+
+class FastJSONResponse(Response):
+    """JSON response rendered with the fastest available backend
+
+    Returning this directly from an endpoint also skips FastAPI's
+    ``jsonable_encoder`` pass, which is only needed for data that is not
+    already made of plain JSON types. Bytes are sent as already-encoded JSON.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
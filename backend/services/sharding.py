@@ -0,0 +1,201 @@
+"""
+Per-user sharding of the dataset files
+
+Each user's conversations, table data and models live in their own directory,
+so a request only reads and rewrites its own user's files. The default user
+(requests without ``X-User-Id``) keeps the original top-level files, so
+existing single-tenant installs need no migration:
+
+    datasets/
+        conversations.json          default user
+        manifest.json               user id -> shard directory
+        users/3f/3f1c.../conversations.json
+
+Shard directories are derived from a hash of the user id, which keeps user
+input out of paths and spreads users over 256 parent directories. The
+manifest lists every shard so admin scans do not walk the tree.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from models.records import CompactRecord
+from services.serialization import dumps, loads
+from services.storage import FileLock, RecordStore, atomic_write, ensure_json_array_file
+
+DEFAULT_USER = "default"
+
+# Called as on_change(user_id, dataset, action, record_id, record_dict) after a write
+ShardChangeCallback = Callable[[str, str, str, Optional[str], Optional[Dict[str, Any]]], Any]
+
+
+class ShardManifest:
+    """The ``manifest.json`` index of user shards"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._users: Dict[str, str] = {}
+        self._mtime_ns: Optional[int] = None
+        self._lock = threading.Lock()
+        self._file_lock: Optional[FileLock] = None
+
+    def _load(self) -> None:
+        try:
+            mtime_ns = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime_ns != self._mtime_ns:
+            self._users = loads(self.path.read_bytes()).get("users", {})
+            self._mtime_ns = mtime_ns
+
+    def users(self) -> Dict[str, str]:
+        """Return ``{user_id: shard directory relative to the datasets dir}``"""
+
+        with self._lock:
+            self._load()
+            return dict(self._users)
+
+    def register(self, user_id: str, shard_dir: str) -> None:
+        """Add a user to the manifest if it is not listed yet"""
+
+        with self._lock:
+            self._load()
+            if self._users.get(user_id) == shard_dir:
+                return
+            if self._file_lock is None:
+                self._file_lock = FileLock(self.path.with_name(self.path.name + ".lock"))
+            with self._file_lock.exclusive():
+                # Another worker may have registered users since the last load
+                self._load()
+                self._users[user_id] = shard_dir
+                atomic_write(self.path, dumps({"version": 1, "users": self._users}))
+                self._mtime_ns = self.path.stat().st_mtime_ns
+
+
+class ShardedStore:
+    """Record stores for every (user, dataset) pair, opened on demand"""
+
+    def __init__(self, base_dir_factory: Callable[[], Path],
+                 datasets: Dict[str, Tuple[str, Type[CompactRecord]]],
+                 on_change: Optional[ShardChangeCallback] = None,
+                 max_open_shards: int = 256, scan_workers: int = 8):
+        self.base_dir_factory = base_dir_factory
+        self.datasets = datasets
+        self.on_change = on_change
+        self.max_open_shards = max_open_shards
+        self.scan_workers = scan_workers
+        self._stores: "OrderedDict[Tuple[str, str], RecordStore]" = OrderedDict()
+        self._manifest: Optional[ShardManifest] = None
+        self._lock = threading.Lock()
+
+    @property
+    def manifest(self) -> ShardManifest:
+        if self._manifest is None:
+            self._manifest = ShardManifest(self.base_dir_factory() / "manifest.json")
+        return self._manifest
+
+    @staticmethod
+    def shard_name(user_id: str) -> str:
+        """Relative shard directory for ``user_id``"""
+
+        if user_id == DEFAULT_USER:
+            return "."
+        digest = hashlib.sha1(user_id.encode("utf-8")).hexdigest()
+        return f"users/{digest[:2]}/{digest}"
+
+    def shard_dir(self, user_id: str) -> Path:
+        return self.base_dir_factory() / self.shard_name(user_id)
+
+    def _create_shard_file(self, user_id: str, path: Path) -> None:
+        """Register the user and create the file on their first write"""
+
+        if user_id != DEFAULT_USER:
+            self.manifest.register(user_id, self.shard_name(user_id))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        ensure_json_array_file(path)
+
+    def store(self, user_id: str, dataset: str) -> RecordStore:
+        """Return the store for one user's dataset, opening it if needed"""
+
+        key = (user_id, dataset)
+        with self._lock:
+            store = self._stores.get(key)
+            if store is not None:
+                self._stores.move_to_end(key)
+                return store
+
+        # Reads of a user that never wrote see empty datasets, so arbitrary
+        # X-User-Id headers do not create shards or grow the manifest
+        filename, record_type = self.datasets[dataset]
+        store = RecordStore(
+            lambda: self.shard_dir(user_id) / filename,
+            record_type,
+            name=dataset,
+            on_change=self._change_callback(user_id),
+            create=lambda path: self._create_shard_file(user_id, path),
+        )
+
+        with self._lock:
+            existing = self._stores.get(key)
+            if existing is not None:
+                return existing
+            self._stores[key] = store
+            while len(self._stores) > self.max_open_shards:
+                _, evicted = self._stores.popitem(last=False)
+                evicted.close()
+        return store
+
+    def _change_callback(self, user_id: str):
+        if self.on_change is None:
+            return None
+
+        def notify(dataset: str, action: str, record_id: Optional[str],
+                   record: Optional[Dict[str, Any]]) -> None:
+            self.on_change(user_id, dataset, action, record_id, record)
+
+        return notify
+
+    def users(self) -> List[str]:
+        """Every user with a shard, including the default user"""
+
+        return [DEFAULT_USER] + sorted(self.manifest.users())
+
+    def scan(self, dataset: str, func: Callable[[str, RecordStore], Any]) -> Dict[str, Any]:
+        """Run ``func(user_id, store)`` over every user's shard in parallel"""
+
+        users = self.users()
+        with ThreadPoolExecutor(max_workers=self.scan_workers) as pool:
+            results = pool.map(lambda user_id: func(user_id, self.store(user_id, dataset)), users)
+            return dict(zip(users, results))
+
+    def migrate_default_shard(self) -> Dict[str, int]:
+        """Move records that carry a ``user_id`` out of the default shard
+
+        Installs that stored every user's records in the top-level files can
+        run this once to split them into per-user shards.
+        """
+
+        def belongs_to_user(record: CompactRecord) -> bool:
+            user_id = record.get("user_id")
+            return bool(record.get("id")) and isinstance(user_id, str) and user_id not in ("", DEFAULT_USER)
+
+        moved = {}
+        for dataset in self.datasets:
+            def copy(records: List[CompactRecord]) -> None:
+                by_user: Dict[str, List[CompactRecord]] = {}
+                for record in records:
+                    by_user.setdefault(record.get("user_id"), []).append(record)
+                for user_id, user_records in by_user.items():
+                    # Mark the default store recently used so opening this shard
+                    # cannot evict, and close, it while its lock is held
+                    self.store(DEFAULT_USER, dataset)
+                    self.store(user_id, dataset).add_many([record.to_dict() for record in user_records])
+
+            # The copy runs under the default store's write lock, so no update is
+            # lost in between; a crash after it can duplicate but never lose records
+            moved[dataset] = self.store(DEFAULT_USER, dataset).move_out(belongs_to_user, copy)
+        return moved
@@ -0,0 +1,448 @@
+"""
+Batch AI-vs-AI negotiation simulator for synthetic dataset rows
+
+Runs many customer-vs-business dialogues concurrently over a grid of
+business types, intents and scenarios. Each exchange (a customer message and
+the business reply) becomes a ``DatasetEntryCreate`` row, and finished
+dialogues are streamed into the ``table_data`` store in batches while the
+rest are still running.
+
+Dialogues can be played by ``AIService`` models, whose calls go through the
+shared request coordinator and therefore respect provider limits, or by the
+local ``StubModel`` for dry runs and load tests. Run from the backend
+directory:
+
+    python -m services.simulator --model stub --per-scenario 50
+    python -m services.simulator --customer-model gpt-4o-mini --business-model claude-3-haiku-20240307
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from models.records import DatasetRecord
+from models.schemas import DatasetEntryCreate, MessageCreate
+from services.ai_coordinator import ProviderOverloaded
+from services.change_feed import ChangeFeed, ChangeLog
+from services.dedup import DEDUP_MODES, MinHasher, StoreIndex
+from services.sharding import DEFAULT_USER, ShardedStore
+from services.storage import RecordStore
+
+CUSTOMER = "customer"
+BUSINESS = "business"
+
+# Rows are validated against DatasetEntryCreate, which caps message length
+MAX_MESSAGE_LENGTH = 2000
+
+# The customer model needs a business turn to answer before the first message
+OPENING_LINE = "Hello! Thanks for reaching out, how can I help you today?"
+
+DEFAULT_BUSINESS_TYPES = ["retail", "saas", "hospitality", "automotive"]
+DEFAULT_INTENTS = ["discount_request", "refund_request", "upgrade_negotiation", "bulk_order"]
+DEFAULT_SCENARIOS = [
+    "The customer is a long-time client comparing a competitor's offer.",
+    "The customer is price sensitive and close to walking away.",
+]
+
+# A reply is another model's output plus the tokens it used
+Reply = Tuple[str, int]
+
+
+@dataclass(frozen=True)
+class Scenario:
+    business_type: str
+    intent: str
+    scenario: str = ""
+
+    def context(self) -> Dict[str, Any]:
+        return {"business_type": self.business_type, "intent": self.intent, "scenario": self.scenario}
+
+
+def scenario_grid(business_types: List[str], intents: List[str],
+                  scenarios: Optional[List[str]] = None) -> List[Scenario]:
+    """Every combination of business type, intent and scenario"""
+
+    return [
+        Scenario(business_type, intent, scenario)
+        for business_type, intent, scenario in itertools.product(business_types, intents, scenarios or [""])
+    ]
+
+
+def judge_outcome(business_response: str) -> str:
+    """Classify how a dialogue ended from the business's last reply"""
+
+    text = business_response.lower()
+    if any(word in text for word in ("deal", "agreed", "i can do that", "happy to offer", "approved")):
+        return "successful"
+    if any(word in text for word in ("instead", "alternative", "meet you", "counter", "partial")):
+        return "partial"
+    return "failed"
+
+
+class StubModel:
+    """Local templated model for dry runs; optionally sleeps to mimic latency"""
+
+    name = "stub"
+
+    CUSTOMER_LINES = {
+        "discount_request": [
+            "I've been looking at your {business_type} offer, is there any discount available?",
+            "That's still above my budget. Could you go a bit lower?",
+            "If you can take another 10% off I'll commit today.",
+        ],
+        "refund_request": [
+            "My last order from your {business_type} store didn't meet expectations, I'd like a refund.",
+            "A store credit doesn't really help me, I need my money back.",
+            "Could you at least refund half of it?",
+        ],
+        "upgrade_negotiation": [
+            "I'm interested in upgrading my {business_type} plan, what can you offer?",
+            "The upgrade price seems steep for what's included.",
+            "Would you include the extras if I upgrade this week?",
+        ],
+        "bulk_order": [
+            "We're planning a large order from your {business_type} business. What are your volume rates?",
+            "Other suppliers quoted us less for the same volume.",
+            "If we double the order, can you match their price?",
+        ],
+    }
+    BUSINESS_LINES = [
+        "Thanks for asking! Our current pricing already includes a loyalty rate.",
+        "I understand. I can offer a smaller discount instead, or add free delivery as an alternative.",
+        "Let me meet you halfway on that.",
+        "You have a deal, I'm happy to offer that and will apply it right away.",
+        "I'm sorry, that's below what we can do on this order.",
+    ]
+
+    def __init__(self, latency: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.random = random.Random(seed)
+
+    async def respond(self, speaker: str, history: List[Tuple[str, str]],
+                      context: Dict[str, Any]) -> Reply:
+        if self.latency:
+            await asyncio.sleep(self.random.uniform(0.5, 1.5) * self.latency)
+        turn = sum(1 for who, _ in history if who == CUSTOMER)
+        if speaker == CUSTOMER:
+            lines = self.CUSTOMER_LINES.get(context.get("intent"), self.CUSTOMER_LINES["discount_request"])
+            text = lines[min(turn, len(lines) - 1)].format(**context)
+        else:
+            # Businesses concede more often as the negotiation goes on
+            weights = [3, 3, 2, 1 + turn, 1]
+            text = self.random.choices(self.BUSINESS_LINES, weights=weights)[0]
+        return text, len(text) // 4
+
+
+class AIServiceModel:
+    """Plays both sides with ``AIService`` models"""
+
+    def __init__(self, ai_service, customer_model: str, business_model: str,
+                 temperature: float = 0.9, max_tokens: int = 300):
+        self.ai_service = ai_service
+        self.customer_model = customer_model
+        self.business_model = business_model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.name = f"{customer_model}/{business_model}"
+
+    async def respond(self, speaker: str, history: List[Tuple[str, str]],
+                      context: Dict[str, Any]) -> Reply:
+        # Each side sees its own turns as "assistant" and the other side's as "user"
+        messages = [MessageCreate(role="user", content=OPENING_LINE)] if speaker == CUSTOMER else []
+        for who, text in history:
+            messages.append(MessageCreate(role="assistant" if who == speaker else "user", content=text))
+        response = await self.ai_service.generate_response(
+            self.customer_model if speaker == CUSTOMER else self.business_model,
+            messages,
+            context=dict(context, persona=speaker),
+            temperature=self.temperature,
+            max_tokens=self.max_tokens
+        )
+        return response.message, response.tokens_used
+
+
+@dataclass
+class SimulationReport:
+    dialogues: int = 0
+    failed_dialogues: int = 0
+    rows: int = 0
+    model_calls: int = 0
+    tokens: int = 0
+    overload_retries: int = 0
+    rejected_duplicates: int = 0
+    batches: int = 0
+    elapsed: float = 0.0
+    outcomes: Dict[str, int] = field(default_factory=dict)
+    turn_latencies: List[float] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        latencies = sorted(self.turn_latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1)
+
+        elapsed = self.elapsed or 1e-9
+        return {
+            "dialogues": self.dialogues,
+            "failed_dialogues": self.failed_dialogues,
+            "rows": self.rows,
+            "model_calls": self.model_calls,
+            "tokens": self.tokens,
+            "overload_retries": self.overload_retries,
+            "rejected_duplicates": self.rejected_duplicates,
+            "batches": self.batches,
+            "elapsed_s": round(self.elapsed, 2),
+            "dialogues_per_s": round(self.dialogues / elapsed, 1),
+            "rows_per_s": round(self.rows / elapsed, 1),
+            "tokens_per_s": round(self.tokens / elapsed, 1),
+            "turn_ms_p50": percentile(0.5),
+            "turn_ms_p95": percentile(0.95),
+            "outcomes": self.outcomes,
+            "errors": self.errors[:10],
+        }
+
+
+class NegotiationSimulator:
+    """Runs dialogues concurrently and streams their rows into a record store"""
+
+    def __init__(self, model, store: RecordStore, turns: int = 3, concurrency: int = 32,
+                 batch_size: int = 200, flush_interval: float = 1.0,
+                 max_overload_retries: int = 5, tags: Optional[List[str]] = None,
+                 dedup_index: Optional[StoreIndex] = None, dedup_mode: str = "off"):
+        self.model = model
+        self.store = store
+        self.turns = turns
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_overload_retries = max_overload_retries
+        self.tags = tags if tags is not None else ["synthetic"]
+        self.dedup_index = dedup_index
+        self.dedup_mode = dedup_mode if dedup_index is not None else "off"
+        self.report = SimulationReport()
+
+    async def _respond(self, speaker: str, history: List[Tuple[str, str]],
+                       context: Dict[str, Any]) -> str:
+        for attempt in range(self.max_overload_retries + 1):
+            started = time.monotonic()
+            try:
+                text, tokens = await self.model.respond(speaker, history, context)
+            except ProviderOverloaded:
+                # The provider is saturated; back off instead of failing the dialogue
+                if attempt == self.max_overload_retries:
+                    raise
+                self.report.overload_retries += 1
+                await asyncio.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1.5))
+                continue
+            self.report.turn_latencies.append(time.monotonic() - started)
+            self.report.model_calls += 1
+            self.report.tokens += tokens or 0
+            text = text.strip()[:MAX_MESSAGE_LENGTH]
+            if not text:
+                raise ValueError(f"empty {speaker} reply")
+            return text
+
+    async def _dialogue(self, scenario: Scenario, variant: int) -> List[Dict[str, Any]]:
+        dialogue_id = str(uuid.uuid4())
+        # The variant keeps identical scenarios from being coalesced into one call
+        context = dict(scenario.context(), variant=variant)
+        history: List[Tuple[str, str]] = []
+        exchanges = []
+        outcome = "failed"
+        for turn in range(self.turns):
+            customer_message = await self._respond(CUSTOMER, history, context)
+            history.append((CUSTOMER, customer_message))
+            business_response = await self._respond(BUSINESS, history, context)
+            history.append((BUSINESS, business_response))
+            exchanges.append((customer_message, business_response))
+            outcome = judge_outcome(business_response)
+            if outcome == "successful":
+                break
+
+        created_at = datetime.now().isoformat()
+        rows = []
+        for turn, (customer_message, business_response) in enumerate(exchanges):
+            entry = DatasetEntryCreate(
+                customer_message=customer_message,
+                business_response=business_response,
+                intent=scenario.intent,
+                business_type=scenario.business_type,
+                outcome=outcome,
+                tags=list(self.tags),
+                metadata={
+                    "source": "simulator",
+                    "model": self.model.name,
+                    "dialogue_id": dialogue_id,
+                    "turn": turn,
+                    "turns": len(exchanges),
+                    "scenario": scenario.scenario,
+                },
+            )
+            row = entry.model_dump()
+            row["id"] = str(uuid.uuid4())
+            row["createdAt"] = created_at
+            rows.append(row)
+        return rows
+
+    async def _writer(self, queue: asyncio.Queue) -> None:
+        """Write finished dialogues in batches, one file write per batch"""
+
+        batch: List[Dict[str, Any]] = []
+        done = False
+        while not done:
+            try:
+                rows = await asyncio.wait_for(queue.get(), self.flush_interval)
+            except asyncio.TimeoutError:
+                rows = []
+            if rows is None:
+                done = True
+            else:
+                batch.extend(rows)
+            if batch and (done or not rows or len(batch) >= self.batch_size):
+                # The store does blocking file I/O, so keep it off the event loop
+                await asyncio.to_thread(self._write, batch)
+                batch = []
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        if self.dedup_mode != "off":
+            batch, rejected = self.dedup_index.screen(batch, self.dedup_mode)
+            self.report.rejected_duplicates += len(rejected)
+            if not batch:
+                return
+        try:
+            self.store.add_many(batch)
+        except BaseException:
+            if self.dedup_mode != "off":
+                self.dedup_index.invalidate()
+            raise
+        if self.dedup_mode != "off":
+            self.dedup_index.committed()
+        self.report.rows += len(batch)
+        self.report.batches += 1
+
+    async def run(self, scenarios: List[Scenario], per_scenario: int = 1) -> SimulationReport:
+        """Simulate ``per_scenario`` dialogues for every scenario"""
+
+        started = time.monotonic()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, self.concurrency * 2))
+        writer = asyncio.create_task(self._writer(queue))
+        jobs = iter([(scenario, variant) for scenario in scenarios for variant in range(per_scenario)])
+
+        async def worker():
+            for scenario, variant in jobs:
+                try:
+                    rows = await self._dialogue(scenario, variant)
+                except Exception as e:
+                    self.report.failed_dialogues += 1
+                    self.report.errors.append(f"{type(e).__name__}: {e}")
+                    continue
+                self.report.dialogues += 1
+                outcome = rows[-1]["outcome"]
+                self.report.outcomes[outcome] = self.report.outcomes.get(outcome, 0) + 1
+                await queue.put(rows)
+
+        workers = asyncio.ensure_future(asyncio.gather(*(worker() for _ in range(self.concurrency))))
+        try:
+            # The writer only stops early when a write failed, and the workers
+            # would then block on the full queue, so stop them with it
+            await asyncio.wait({workers, writer}, return_when=asyncio.FIRST_COMPLETED)
+            if writer.done():
+                workers.cancel()
+                await writer
+            try:
+                await workers
+            finally:
+                # Write what the workers finished, even if one of them failed
+                await queue.put(None)
+                await writer
+        finally:
+            workers.cancel()
+            writer.cancel()
+            # Collect the cancelled tasks so their outcome is not reported as unhandled
+            await asyncio.gather(workers, writer, return_exceptions=True)
+            self.report.elapsed = time.monotonic() - started
+        return self.report
+
+
+def _split(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", choices=["stub", "ai"], default="stub",
+                        help="stub for a local dry run, ai to use AIService models")
+    parser.add_argument("--customer-model", default="gpt-4o-mini")
+    parser.add_argument("--business-model", default="gpt-4o-mini")
+    parser.add_argument("--business-types", type=_split, default=DEFAULT_BUSINESS_TYPES)
+    parser.add_argument("--intents", type=_split, default=DEFAULT_INTENTS)
+    parser.add_argument("--scenarios", type=lambda value: [s.strip() for s in value.split("|")],
+                        default=DEFAULT_SCENARIOS, help="scenarios separated by |")
+    parser.add_argument("--per-scenario", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--stub-latency", type=float, default=0.0)
+    parser.add_argument("--user-id", default=DEFAULT_USER)
+    parser.add_argument("--dedup", choices=DEDUP_MODES, default=os.getenv("DEDUP_MODE", "flag"),
+                        help="screen rows for near-duplicates of existing rows")
+    parser.add_argument("--datasets-dir", type=Path, default=Path.home() / "Documents" / "datasets")
+    args = parser.parse_args()
+
+    if args.model == "ai":
+        from services.ai_service import AIService
+        model = AIServiceModel(AIService(), args.customer_model, args.business_model)
+    else:
+        model = StubModel(latency=args.stub_latency)
+
+    args.datasets_dir.mkdir(parents=True, exist_ok=True)
+    # Publish written rows to /api/changes subscribers of running workers
+    change_feed = ChangeFeed(log=ChangeLog(lambda: args.datasets_dir / "changes.log"))
+    dataset_store = ShardedStore(
+        lambda: args.datasets_dir,
+        {"table_data": ("table_data.json", DatasetRecord)},
+        on_change=lambda user_id, dataset, action, record_id, record: change_feed.publish(
+            dataset, action, record_id, record, user_id=user_id),
+    )
+    store = dataset_store.store(args.user_id, "table_data")
+    simulator = NegotiationSimulator(
+        model,
+        store,
+        turns=args.turns,
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        dedup_index=StoreIndex(store, MinHasher(), threshold=float(os.getenv("DEDUP_THRESHOLD", "0.85"))),
+        dedup_mode=args.dedup,
+    )
+    scenarios = scenario_grid(args.business_types, args.intents, args.scenarios)
+    report = asyncio.run(simulator.run(scenarios, per_scenario=args.per_scenario)).to_dict()
+
+    print(f"scenarios: {len(scenarios)}, dialogues: {report['dialogues']} "
+          f"({report['failed_dialogues']} failed), rows written: {report['rows']} "
+          f"in {report['batches']} batches")
+    print(f"elapsed: {report['elapsed_s']}s, {report['dialogues_per_s']} dialogues/s, "
+          f"{report['rows_per_s']} rows/s, {report['tokens_per_s']} tokens/s")
+    print(f"model calls: {report['model_calls']}, overload retries: {report['overload_retries']}, "
+          f"rejected near-duplicates: {report['rejected_duplicates']}, "
+          f"turn p50/p95: {report['turn_ms_p50']}/{report['turn_ms_p95']} ms")
+    print(f"outcomes: {report['outcomes']}")
+    for error in report["errors"]:
+        print(f"error: {error}")
+    if args.model == "ai":
+        from services.ai_service import default_coordinator
+        print(f"coordinator: {default_coordinator.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+"""
+Incremental snapshots of the datasets directory
+
+A snapshot records every file in the datasets directory as a list of chunks.
+Chunks are stored once, compressed and named by the SHA-256 of their content,
+so a snapshot only writes the chunks that changed since earlier snapshots:
+
+    dataset-snapshots/
+        chunks/3f/3f1c...        zlib-compressed chunk
+        snapshots/20261019T160900123456Z.json
+
+Dataset files are JSON arrays, so they are cut between records, at records
+whose hash hits a boundary condition. Adding, changing or removing a record
+then only changes the chunk that holds it. Other files are cut into
+fixed-size chunks. Files whose inode, mtime, size and generation match the
+previous snapshot are not read at all, so the cost of a snapshot follows the
+amount of change.
+
+Snapshots are taken while the API keeps writing. For each directory the
+shared locks of its dataset files are held only while the files are opened.
+Writers replace files by renaming, so the open files keep showing the version
+that was current at that moment, and the snapshot reads them after the locks
+are released.
+
+Run from the backend directory:
+
+    python -m services.snapshots create
+    python -m services.snapshots list
+    python -m services.snapshots restore 20261019T160900123456Z [--target DIR]
+    python -m services.snapshots prune --keep 10
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Set, Tuple
+
+from services.change_feed import ChangeFeed, ChangeLog
+from services.serialization import dumps, loads
+from services.storage import FileLock, atomic_write
+
+COMPRESS_LEVEL = 6
+
+# Record chunks are cut after MIN_CHUNK_SIZE bytes at a record whose hash is
+# divisible by CUT_EVERY, and always by MAX_CHUNK_SIZE
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+CUT_EVERY = 16
+RAW_CHUNK_SIZE = 256 * 1024
+
+# Lock files, half-written temp files and the change log are never part of a snapshot
+SKIPPED_SUFFIXES = (".lock", ".tmp", ".log")
+
+# The shard index, which an in-place restore merges instead of replacing
+SHARD_MANIFEST = "manifest.json"
+
+_SNAPSHOT_ID = re.compile(r"\d{8}T\d{12}Z")
+
+
+def record_chunks(body: bytes) -> Optional[List[bytes]]:
+    """Split a JSON array between records, or ``None`` if ``body`` is not one
+
+    Only bodies that re-encode to exactly the same bytes are split this way,
+    so restoring ``[`` + chunks joined by ``,`` + ``]`` gives the original file.
+    """
+
+    try:
+        documents = loads(body)
+    except Exception:
+        return None
+    if not isinstance(documents, list):
+        return None
+    pieces = [dumps(document) for document in documents]
+    if b"[" + b",".join(pieces) + b"]" != body:
+        return None
+
+    chunks, current, size = [], [], 0
+    for piece in pieces:
+        current.append(piece)
+        size += len(piece) + 1
+        if size >= MAX_CHUNK_SIZE or (size >= MIN_CHUNK_SIZE and zlib.crc32(piece) % CUT_EVERY == 0):
+            chunks.append(b",".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append(b",".join(current))
+    return chunks
+
+
+def raw_chunks(body: bytes) -> List[bytes]:
+    return [body[i:i + RAW_CHUNK_SIZE] for i in range(0, len(body), RAW_CHUNK_SIZE)]
+
+
+def merge_shard_manifest(restored: bytes, current: bytes) -> bytes:
+    """Add users registered after the snapshot to a restored shard manifest"""
+
+    manifest = loads(restored)
+    manifest["users"] = {**manifest.get("users", {}), **loads(current).get("users", {})}
+    return dumps(manifest)
+
+
+def assemble(entry: Dict[str, Any], chunks: List[bytes]) -> bytes:
+    if entry["format"] == "records":
+        return b"[" + b",".join(chunks) + b"]"
+    return b"".join(chunks)
+
+
+class SnapshotRepository:
+    """Content-addressed snapshots of one datasets directory"""
+
+    def __init__(self, repo_dir_factory: Callable[[], Path], source_dir_factory: Callable[[], Path],
+                 compress_level: int = COMPRESS_LEVEL, workers: int = 4,
+                 on_restore: Optional[Callable[[str], Any]] = None):
+        self.repo_dir_factory = repo_dir_factory
+        self.source_dir_factory = source_dir_factory
+        self.compress_level = compress_level
+        self.workers = workers
+        # Called with the snapshot id once files were restored over the datasets directory
+        self.on_restore = on_restore
+
+    @property
+    def repo_dir(self) -> Path:
+        repo_dir = Path(self.repo_dir_factory())
+        (repo_dir / "chunks").mkdir(parents=True, exist_ok=True)
+        (repo_dir / "snapshots").mkdir(parents=True, exist_ok=True)
+        return repo_dir
+
+    def _repository_lock(self) -> FileLock:
+        return FileLock(self.repo_dir / "repository.lock")
+
+    def _chunk_path(self, digest: str) -> Path:
+        return self.repo_dir / "chunks" / digest[:2] / digest
+
+    def _manifest_path(self, snapshot_id: str) -> Path:
+        if not _SNAPSHOT_ID.fullmatch(snapshot_id):
+            raise KeyError(snapshot_id)
+        return self.repo_dir / "snapshots" / f"{snapshot_id}.json"
+
+    def snapshot_ids(self) -> List[str]:
+        """Snapshot ids, oldest first"""
+
+        return sorted(path.stem for path in (self.repo_dir / "snapshots").glob("*.json")
+                      if _SNAPSHOT_ID.fullmatch(path.stem))
+
+    def load(self, snapshot_id: str) -> Dict[str, Any]:
+        """Return a snapshot's manifest; raises ``KeyError`` if it does not exist"""
+
+        try:
+            return loads(self._manifest_path(snapshot_id).read_bytes())
+        except FileNotFoundError:
+            raise KeyError(snapshot_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [
+            {"id": manifest["id"], "created_at": manifest["created_at"],
+             "parent": manifest.get("parent"), "files": len(manifest["files"]), **manifest["stats"]}
+            for manifest in map(self.load, self.snapshot_ids())
+        ]
+
+    def _source_files(self, source_dir: Path, repo_dir: Path) -> Dict[Path, List[Path]]:
+        """Files to snapshot grouped by directory"""
+
+        groups: Dict[Path, List[Path]] = {}
+        for directory, dirnames, filenames in os.walk(source_dir):
+            directory = Path(directory)
+            # The repository may live inside the datasets directory
+            dirnames[:] = sorted(d for d in dirnames if (directory / d).resolve() != repo_dir)
+            files = sorted(directory / name for name in filenames
+                           if not name.endswith(SKIPPED_SUFFIXES))
+            if files:
+                groups[directory] = files
+        return groups
+
+    def _open_group(self, files: List[Path]) -> List[Tuple[Path, BinaryIO, os.stat_result, int]]:
+        """Open a directory's files as one consistent version
+
+        Shared locks are taken on every file that has a lock file, so no writer
+        is part way through a write, and released as soon as the files are open.
+        """
+
+        opened = []
+        with ExitStack() as stack:
+            locks = {}
+            for path in files:
+                lock_path = path.with_name(path.name + ".lock")
+                if lock_path.exists():
+                    lock = FileLock(lock_path)
+                    stack.callback(lock.close)
+                    stack.enter_context(lock.shared())
+                    locks[path] = lock
+            for path in files:
+                try:
+                    f = open(path, "rb")
+                except FileNotFoundError:
+                    continue
+                lock = locks.get(path)
+                opened.append((path, f, os.fstat(f.fileno()), lock.generation() if lock else 0))
+        return opened
+
+    def _store_chunks(self, chunks: List[bytes], stats: Dict[str, int]) -> List[str]:
+        digests = [hashlib.sha256(chunk).hexdigest() for chunk in chunks]
+        missing = {}
+        for digest, chunk in zip(digests, chunks):
+            if digest not in missing and not self._chunk_path(digest).exists():
+                missing[digest] = chunk
+
+        def write(item: Tuple[str, bytes]) -> int:
+            digest, chunk = item
+            path = self._chunk_path(digest)
+            path.parent.mkdir(exist_ok=True)
+            compressed = zlib.compress(chunk, self.compress_level)
+            atomic_write(path, compressed)
+            return len(compressed)
+
+        # zlib releases the GIL, so chunks compress in parallel
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            stored = list(pool.map(write, missing.items()))
+        stats["new_chunks"] += len(stored)
+        stats["new_bytes"] += sum(len(chunk) for chunk in missing.values())
+        stats["stored_bytes"] += sum(stored)
+        return digests
+
+    def create(self) -> Dict[str, Any]:
+        """Snapshot the datasets directory, storing only chunks not stored before"""
+
+        started = time.perf_counter()
+        source_dir = Path(self.source_dir_factory())
+        repo_dir = self.repo_dir.resolve()
+        repository_lock = self._repository_lock()
+        try:
+            with repository_lock.exclusive():
+                ids = self.snapshot_ids()
+                parent = self.load(ids[-1]) if ids else None
+                previous = parent["files"] if parent else {}
+                snapshot_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+                if ids and snapshot_id <= ids[-1]:
+                    raise RuntimeError("snapshot ids must increase; check the system clock")
+
+                stats = {"total_bytes": 0, "changed_files": 0, "unchanged_files": 0,
+                         "new_chunks": 0, "new_bytes": 0, "stored_bytes": 0}
+                files: Dict[str, Dict[str, Any]] = {}
+                for directory, group in self._source_files(source_dir, repo_dir).items():
+                    for path, f, stat, generation in self._open_group(group):
+                        with f:
+                            name = path.relative_to(source_dir).as_posix()
+                            entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                                     "inode": stat.st_ino, "generation": generation}
+                            stats["total_bytes"] += stat.st_size
+                            old = previous.get(name)
+                            if old and all(old[key] == entry[key] for key in entry):
+                                files[name] = old
+                                stats["unchanged_files"] += 1
+                                continue
+                            body = f.read()
+                            chunks = record_chunks(body) if path.suffix == ".json" else None
+                            entry["format"] = "records" if chunks is not None else "raw"
+                            if chunks is None:
+                                chunks = raw_chunks(body)
+                            entry["chunks"] = self._store_chunks(chunks, stats)
+                            files[name] = entry
+                            stats["changed_files"] += 1
+
+                stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                manifest = {
+                    "id": snapshot_id,
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "parent": parent["id"] if parent else None,
+                    "files": files,
+                    "stats": stats,
+                }
+                atomic_write(self._manifest_path(snapshot_id), dumps(manifest))
+        finally:
+            repository_lock.close()
+        return {"id": snapshot_id, "files": len(files), **stats}
+
+    def _read_chunk(self, digest: str) -> bytes:
+        chunk = zlib.decompress(self._chunk_path(digest).read_bytes())
+        if hashlib.sha256(chunk).hexdigest() != digest:
+            raise ValueError(f"chunk {digest} is corrupt")
+        return chunk
+
+    def restore(self, snapshot_id: str, target_dir: Optional[Path] = None) -> Dict[str, Any]:
+        """Restore a snapshot into ``target_dir``, or over the datasets directory
+
+        Restoring in place writes each dataset file under its exclusive lock and
+        bumps its generation, so running workers reload it, and then calls
+        ``on_restore``, also when the restore failed part way. Files created
+        after the snapshot are left alone and listed in the result, and the
+        shard manifest keeps the users registered after the snapshot.
+        """
+
+        started = time.perf_counter()
+        in_place = target_dir is None
+        target_dir = Path(self.source_dir_factory() if in_place else target_dir)
+        repository_lock = self._repository_lock()
+        written = restored = 0
+        try:
+            with repository_lock.shared():
+                manifest = self.load(snapshot_id)
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    for name, entry in sorted(manifest["files"].items()):
+                        body = assemble(entry, list(pool.map(self._read_chunk, entry["chunks"])))
+                        path = target_dir / name
+                        path.parent.mkdir(parents=True, exist_ok=True)
+                        lock_path = path.with_name(path.name + ".lock")
+                        lock = FileLock(lock_path) if in_place and lock_path.exists() else None
+                        try:
+                            with lock.exclusive() if lock is not None else nullcontext():
+                                if in_place and name == SHARD_MANIFEST and path.exists():
+                                    body = merge_shard_manifest(body, path.read_bytes())
+                                atomic_write(path, body)
+                                if lock is not None:
+                                    lock.bump()
+                        finally:
+                            if lock is not None:
+                                lock.close()
+                        written += len(body)
+                        restored += 1
+        finally:
+            repository_lock.close()
+            if in_place and restored and self.on_restore is not None:
+                self.on_restore(snapshot_id)
+
+        repo_dir = self.repo_dir.resolve()
+        extra = sorted(
+            path.relative_to(target_dir).as_posix()
+            for group in self._source_files(target_dir, repo_dir).values() for path in group
+            if path.relative_to(target_dir).as_posix() not in manifest["files"]
+        )
+        return {
+            "id": snapshot_id,
+            "target": str(target_dir),
+            "files": len(manifest["files"]),
+            "bytes": written,
+            "not_in_snapshot": extra,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    def prune(self, keep: int) -> Dict[str, Any]:
+        """Delete all but the newest ``keep`` snapshots and the chunks only they used"""
+
+        repository_lock = self._repository_lock()
+        try:
+            with repository_lock.exclusive():
+                ids = self.snapshot_ids()
+                removed = ids[:-keep] if keep > 0 else ids
+                for snapshot_id in removed:
+                    self._manifest_path(snapshot_id).unlink()
+                referenced: Set[str] = set()
+                for snapshot_id in self.snapshot_ids():
+                    for entry in self.load(snapshot_id)["files"].values():
+                        referenced.update(entry["chunks"])
+                deleted_chunks = freed = 0
+                for path in (self.repo_dir / "chunks").glob("*/*"):
+                    if path.name not in referenced:
+                        freed += path.stat().st_size
+                        path.unlink()
+                        deleted_chunks += 1
+        finally:
+            repository_lock.close()
+        return {"removed_snapshots": removed, "deleted_chunks": deleted_chunks, "freed_bytes": freed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental snapshots of the datasets directory")
+    parser.add_argument("--datasets-dir", type=Path, default=Path.home() / "Documents" / "datasets")
+    parser.add_argument("--snapshot-dir", type=Path,
+                        default=Path(os.getenv("SNAPSHOT_DIR", Path.home() / "Documents" / "dataset-snapshots")))
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("create")
+    commands.add_parser("list")
+    restore = commands.add_parser("restore")
+    restore.add_argument("snapshot_id")
+    restore.add_argument("--target", type=Path, default=None,
+                         help="restore into this directory instead of over the datasets directory")
+    prune = commands.add_parser("prune")
+    prune.add_argument("--keep", type=int, required=True)
+    args = parser.parse_args()
+
+    # Tell /api/changes subscribers of running workers to refetch after a restore
+    change_feed = ChangeFeed(log=ChangeLog(lambda: args.datasets_dir / "changes.log"))
+    repository = SnapshotRepository(
+        lambda: args.snapshot_dir, lambda: args.datasets_dir,
+        on_restore=lambda snapshot_id: change_feed.publish(None, "reset", None),
+    )
+    if args.command == "create":
+        result = repository.create()
+    elif args.command == "list":
+        result = repository.list()
+    elif args.command == "restore":
+        result = repository.restore(args.snapshot_id, args.target)
+    else:
+        result = repository.prune(args.keep)
+    print(dumps(result).decode("utf-8"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+File-backed record store for the JSON datasets
+
+Each store keeps its file's records resident as compact records together with
+the encoded JSON body, so reads neither re-parse the file nor re-encode the
+records.
+
+The store is safe to use from several processes (``uvicorn --workers N``).
+Every dataset file has a ``.lock`` file next to it: writers hold an exclusive
+``flock`` on it for the whole read-modify-write, and files are replaced
+atomically so readers never see a partial document. The lock file also holds
+a generation counter that writers bump, which together with the file's mtime
+and size tells each process when its cache is stale.
+"""
+
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Type
+
+from models.records import CompactRecord, decode_records
+from services.serialization import dumps, loads
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process locking (e.g. Windows); only run a single worker there
+    fcntl = None
+
+# Called as on_change(store_name, action, record_id, record_dict) after a write
+ChangeCallback = Callable[[str, str, Optional[str], Optional[Dict[str, Any]]], Any]
+
+# (mtime_ns, size, generation) of a dataset file
+Version = Tuple[int, int, int]
+
+# Version of a dataset file that has not been written yet
+EMPTY_VERSION: Version = (0, 0, 0)
+
+_GENERATION = struct.Struct("<Q")
+
+
+class FileLock:
+    """``flock``-based lock file that also stores a generation counter"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    @contextmanager
+    def _locked(self, operation: int) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._fd, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def shared(self):
+        return self._locked(fcntl.LOCK_SH if fcntl else 0)
+
+    def exclusive(self):
+        return self._locked(fcntl.LOCK_EX if fcntl else 0)
+
+    def generation(self) -> int:
+        data = os.pread(self._fd, _GENERATION.size, 0)
+        return _GENERATION.unpack(data)[0] if len(data) == _GENERATION.size else 0
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+    def bump(self) -> int:
+        """Increment the generation; the caller must hold the exclusive lock"""
+
+        generation = self.generation() + 1
+        os.pwrite(self._fd, _GENERATION.pack(generation), 0)
+        return generation
+
+
+def ensure_json_array_file(path: Path) -> Path:
+    """Create ``path`` holding an empty JSON array unless it already exists"""
+
+    # O_EXCL creation so concurrent workers never truncate a file another one created
+    try:
+        with open(path, "x") as f:
+            f.write("[]")
+    except FileExistsError:
+        pass
+    return path
+
+
+def atomic_write(path: Path, body: bytes) -> None:
+    """Replace ``path`` with ``body`` so readers see the old or new file, never a mix"""
+
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+class RecordStore:
+    """Cached access to one JSON array of records on disk"""
+
+    def __init__(self, path_factory: Callable[[], Path], record_type: Type[CompactRecord],
+                 name: str = "", on_change: Optional[ChangeCallback] = None,
+                 create: Callable[[Path], Any] = ensure_json_array_file):
+        self.path_factory = path_factory
+        self.record_type = record_type
+        self.name = name
+        self.on_change = on_change
+        # Creates the file on the first write; reads of a missing file see []
+        self.create = create
+        # Decoded from ``_body`` on first use; list endpoints only need the body
+        self._records: Optional[List[CompactRecord]] = []
+        self._body: bytes = b"[]"
+        self._signature: Optional[Version] = None
+        self._file_locks: Dict[Path, FileLock] = {}
+        self._lock = threading.RLock()
+
+    def _file_lock(self, path: Path) -> FileLock:
+        lock = self._file_locks.get(path)
+        if lock is None:
+            lock = FileLock(path.with_name(path.name + ".lock"))
+            self._file_locks[path] = lock
+        return lock
+
+    @staticmethod
+    def _file_signature(path: Path, lock: FileLock) -> Version:
+        stat = path.stat()
+        return stat.st_mtime_ns, stat.st_size, lock.generation()
+
+    def _load_if_changed(self, path: Path, lock: FileLock) -> None:
+        """Reload the file if another process or an editor changed it"""
+
+        if self._file_signature(path, lock) == self._signature:
+            return
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            body = f.read()
+        self._records = None
+        self._body = body
+        self._signature = (stat.st_mtime_ns, stat.st_size, lock.generation())
+
+    def _decoded(self) -> List[CompactRecord]:
+        if self._records is None:
+            self._records = decode_records(self.record_type, loads(self._body))
+        return self._records
+
+    def _refresh(self) -> None:
+        path = self.path_factory()
+        if not path.exists():
+            # Reads never create the file or its lock file
+            self._records, self._body, self._signature = [], b"[]", EMPTY_VERSION
+            return
+        lock = self._file_lock(path)
+        if self._file_signature(path, lock) != self._signature:
+            # Shared lock so the body and generation are read as one version
+            with lock.shared():
+                self._load_if_changed(path, lock)
+
+    @contextmanager
+    def _writing(self) -> Iterator[Tuple[Path, FileLock]]:
+        """Hold the thread and file locks with the cache brought up to date"""
+
+        with self._lock:
+            path = self.path_factory()
+            if not path.exists():
+                self.create(path)
+            lock = self._file_lock(path)
+            with lock.exclusive():
+                self._load_if_changed(path, lock)
+                self._decoded()
+                try:
+                    yield path, lock
+                except BaseException:
+                    # The resident records may no longer match the file
+                    self._signature = None
+                    raise
+
+    def _persist(self, path: Path, lock: FileLock) -> None:
+        body = dumps([record.to_dict() for record in self._records])
+        atomic_write(path, body)
+        generation = lock.bump()
+        stat = path.stat()
+        self._body = body
+        self._signature = (stat.st_mtime_ns, stat.st_size, generation)
+
+    def close(self) -> None:
+        """Release the lock files; the store reopens them if used again"""
+
+        with self._lock:
+            for lock in self._file_locks.values():
+                lock.close()
+            self._file_locks.clear()
+
+    def _notify(self, action: str, record_id: Optional[str],
+                record: Optional[CompactRecord] = None) -> None:
+        if self.on_change is not None:
+            self.on_change(self.name, action, record_id, record.to_dict() if record else None)
+
+    def records(self) -> List[CompactRecord]:
+        """Return a snapshot of the resident records"""
+
+        with self._lock:
+            self._refresh()
+            return list(self._decoded())
+
+    def encoded(self) -> bytes:
+        """Return the stored JSON array, already encoded"""
+
+        with self._lock:
+            self._refresh()
+            return self._body
+
+    def version(self) -> Version:
+        """Return the file's version without reading it"""
+
+        with self._lock:
+            path = self.path_factory()
+            if not path.exists():
+                return EMPTY_VERSION
+            return self._file_signature(path, self._file_lock(path))
+
+    def versioned_body(self) -> Tuple[Version, bytes]:
+        """Return the encoded body together with the version it belongs to"""
+
+        with self._lock:
+            self._refresh()
+            return self._signature, self._body
+
+    def add(self, data: Dict[str, Any]) -> CompactRecord:
+        """Append a new record built from ``data``"""
+
+        with self._writing() as (path, lock):
+            record = self.record_type.from_dict(data)
+            self._records.append(record)
+            self._persist(path, lock)
+            self._notify("created", record.get("id"), record)
+            return record
+
+    def add_many(self, documents: List[Dict[str, Any]]) -> List[CompactRecord]:
+        """Append several records with a single file write"""
+
+        with self._writing() as (path, lock):
+            records = [self.record_type.from_dict(data) for data in documents]
+            self._records.extend(records)
+            self._persist(path, lock)
+            for record in records:
+                self._notify("created", record.get("id"), record)
+            return records
+
+    def replace(self, record_id: str, data: Dict[str, Any]) -> Optional[CompactRecord]:
+        """Replace the record with ``record_id``; returns ``None`` if absent"""
+
+        with self._writing() as (path, lock):
+            for i, existing in enumerate(self._records):
+                if existing.get("id") == record_id:
+                    record = self.record_type.from_dict(data)
+                    self._records[i] = record
+                    self._persist(path, lock)
+                    self._notify("updated", record_id, record)
+                    return record
+            return None
+
+    def delete(self, record_id: str) -> bool:
+        """Remove every record with ``record_id``; returns whether any existed"""
+
+        with self._writing() as (path, lock):
+            remaining = [record for record in self._records if record.get("id") != record_id]
+            if len(remaining) == len(self._records):
+                return False
+            self._records = remaining
+            self._persist(path, lock)
+            self._notify("deleted", record_id)
+            return True
+
+    def delete_many(self, record_ids: Set[str]) -> int:
+        """Remove every record whose id is in ``record_ids`` with a single write"""
+
+        with self._writing() as (path, lock):
+            remaining, removed = [], []
+            for record in self._records:
+                record_id = record.get("id")
+                if record_id in record_ids:
+                    removed.append(record_id)
+                else:
+                    remaining.append(record)
+            if removed:
+                self._records = remaining
+                self._persist(path, lock)
+                for record_id in removed:
+                    self._notify("deleted", record_id)
+            return len(removed)
+
+    def move_out(self, select: Callable[[CompactRecord], bool],
+                 copy: Callable[[List[CompactRecord]], Any]) -> int:
+        """Pass the selected records to ``copy``, then remove them, in one write
+
+        ``copy`` runs under this store's write lock, so no update to a selected
+        record can land between the copy and the removal.
+        """
+
+        with self._writing() as (path, lock):
+            remaining, moved = [], []
+            for record in self._records:
+                (moved if select(record) else remaining).append(record)
+            if moved:
+                copy(moved)
+                self._records = remaining
+                self._persist(path, lock)
+                for record in moved:
+                    self._notify("deleted", record.get("id"))
+            return len(moved)
@@ -0,0 +1,154 @@
+"""
+Request coordinator behaviour against the fake 429 provider from
+``benchmarks.bench_ai_coordinator``
+"""
+
+import argparse
+import asyncio
+import time
+
+import pytest
+
+from benchmarks.bench_ai_coordinator import FakeProvider, FakeRateLimitError, busiest_second, run
+from services.ai_coordinator import ProviderLimits, ProviderOverloaded, RequestCoordinator, request_key
+
+
+def make_coordinator(**limits) -> RequestCoordinator:
+    return RequestCoordinator({"fake": ProviderLimits(**limits)})
+
+
+def test_identical_requests_share_one_call():
+    provider = FakeProvider(rps=100, latency=0.05, error_rate=0)
+    coordinator = make_coordinator(requests_per_minute=6000)
+
+    async def scenario():
+        key = request_key("fake", {"prompt": "Any discount?"})
+        return await asyncio.gather(*(
+            coordinator.submit("fake", key, lambda: provider.complete("Any discount?", 10))
+            for _ in range(5)
+        ))
+
+    results = asyncio.run(scenario())
+
+    assert len(provider.calls) == 1
+    assert all(result == results[0] for result in results)
+    assert coordinator.stats()["fake"]["coalesced"] == 4
+
+
+def test_request_key_ignores_case_and_whitespace():
+    assert request_key("fake", {"prompt": "Any  discount?"}) == request_key("fake", {"prompt": "any discount?"})
+    assert request_key("fake", {"prompt": "a"}) != request_key("other", {"prompt": "a"})
+
+
+def test_cancelled_caller_does_not_fail_coalesced_callers():
+    provider = FakeProvider(rps=100, latency=0.1, error_rate=0)
+    coordinator = make_coordinator(requests_per_minute=6000)
+
+    async def scenario():
+        call = lambda: provider.complete("Any discount?", 10)
+        first = asyncio.ensure_future(coordinator.submit("fake", "key", call))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(coordinator.submit("fake", "key", call))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first
+
+    result, first = asyncio.run(scenario())
+
+    assert first.cancelled()
+    assert result["content"] == "reply to Any discount?"
+    assert len(provider.calls) == 1
+
+
+def test_call_is_cancelled_when_every_caller_leaves():
+    started, finished = [], []
+
+    async def slow_call():
+        started.append(True)
+        await asyncio.sleep(1)
+        finished.append(True)
+
+    coordinator = make_coordinator()
+
+    async def scenario():
+        caller = asyncio.ensure_future(coordinator.submit("fake", "key", slow_call))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.sleep(0.05)
+        return coordinator._in_flight
+
+    in_flight = asyncio.run(scenario())
+
+    assert started and not finished
+    assert not in_flight
+
+
+def test_429_pauses_for_retry_after_and_retries():
+    attempts = []
+
+    async def call():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise FakeRateLimitError(retry_after=0.3)
+        return "ok"
+
+    coordinator = make_coordinator(requests_per_minute=6000, max_wait=5)
+
+    assert asyncio.run(coordinator.submit("fake", "key", call)) == "ok"
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.3
+    assert coordinator.stats()["fake"]["rate_limited"] == 1
+
+
+def test_requests_beyond_the_queue_are_shed():
+    coordinator = make_coordinator(max_concurrency=1, max_queue=2, max_wait=5)
+
+    async def call():
+        await asyncio.sleep(0.2)
+
+    async def scenario():
+        return await asyncio.gather(
+            *(coordinator.submit("fake", f"key {i}", call) for i in range(6)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(scenario())
+    shed = [result for result in results if isinstance(result, ProviderOverloaded)]
+
+    assert shed and all(result.reason == "queue is full" for result in shed)
+    assert coordinator.stats()["fake"]["shed"] == len(shed)
+
+
+def test_waits_past_max_wait_are_shed_instead_of_queued():
+    coordinator = make_coordinator(requests_per_minute=60, max_wait=0.5)
+
+    async def call():
+        return "ok"
+
+    async def scenario():
+        return await asyncio.gather(
+            *(coordinator.submit("fake", f"key {i}", call) for i in range(5)),
+            return_exceptions=True,
+        )
+
+    start = time.monotonic()
+    results = asyncio.run(scenario())
+
+    # One request per second with one second of burst: only the first fits in 0.5s
+    assert results[0] == "ok"
+    assert all(isinstance(result, ProviderOverloaded) for result in results[1:])
+    assert time.monotonic() - start < 1.5
+
+
+def test_busiest_second():
+    assert busiest_second([0.0, 0.5, 0.9, 1.2, 3.0]) == 3
+
+
+@pytest.mark.parametrize("rps", [10, 20])
+def test_provider_rate_limit_is_respected_under_load(rps):
+    args = argparse.Namespace(
+        rps=rps, requests=120, duplicates=4, concurrency=8, max_queue=100,
+        max_wait=1.5, max_tokens=200, latency=0.02, error_rate=0.05,
+    )
+
+    assert asyncio.run(run(args))
@@ -0,0 +1,105 @@
+"""
+Change feed shared between workers through the change log
+"""
+
+import asyncio
+
+from services.change_feed import ChangeFeed, ChangeLog, event_stream
+
+
+def make_feeds(tmp_path, count=2, max_events=1000):
+    # Each feed has its own ChangeLog, like separate worker processes
+    return [
+        ChangeFeed(log=ChangeLog(lambda: tmp_path / "changes.log", max_events=max_events), poll_interval=0.01)
+        for _ in range(count)
+    ]
+
+
+def test_workers_share_one_stream_and_sequence(tmp_path):
+    first, second = make_feeds(tmp_path)
+
+    first.publish("conversations", "created", "a", user_id="u1")
+    second.publish("conversations", "created", "b", user_id="u1")
+
+    assert first.stream_id == second.stream_id
+
+    async def backlog(feed):
+        subscription, events, complete = feed.subscribe(since=0)
+        feed.unsubscribe(subscription)
+        return [(event["seq"], event["id"]) for event in events], complete
+
+    assert asyncio.run(backlog(first)) == ([(1, "a"), (2, "b")], True)
+    assert asyncio.run(backlog(second)) == ([(1, "a"), (2, "b")], True)
+
+
+def test_subscriber_receives_changes_from_another_worker(tmp_path):
+    first, second = make_feeds(tmp_path)
+
+    async def scenario():
+        subscription, _, _ = first.subscribe()
+        try:
+            second.publish("table_data", "created", "row", user_id="u1")
+            return await subscription.next_event(timeout=2)
+        finally:
+            first.unsubscribe(subscription)
+
+    event = asyncio.run(scenario())
+
+    assert event["id"] == "row"
+    assert event["seq"] == 1
+
+
+def test_compaction_keeps_the_newest_events(tmp_path):
+    (feed,) = make_feeds(tmp_path, count=1, max_events=4)
+    for i in range(10):
+        feed.publish("conversations", "created", str(i))
+
+    _, events, _ = feed.log.read(None)
+
+    # Trimmed to the last four events at seq 8, then two more appended
+    assert [event["seq"] for event in events] == [5, 6, 7, 8, 9, 10]
+
+
+def test_missed_events_after_compaction_reset_subscribers(tmp_path):
+    reader, writer = make_feeds(tmp_path, max_events=4)
+    reader.publish("conversations", "created", "first")
+
+    async def scenario():
+        subscription, _, _ = reader.subscribe()
+        try:
+            # Stop the reader's poller from keeping up while the log is compacted
+            with reader._lock:
+                for i in range(10):
+                    writer.publish("conversations", "created", str(i))
+            events = []
+            while True:
+                event = await subscription.next_event(timeout=1)
+                if event is None:
+                    return events
+                events.append(event["action"])
+        finally:
+            reader.unsubscribe(subscription)
+
+    actions = asyncio.run(scenario())
+
+    assert actions[0] == "reset"
+    assert actions[1:] == ["created"] * len(actions[1:])
+
+
+def test_resets_are_streamed_to_user_filtered_subscribers(tmp_path):
+    (feed,) = make_feeds(tmp_path, count=1)
+
+    async def scenario():
+        stream = event_stream(feed, since=None, heartbeat=5, user_id="u1")
+        messages = [await stream.__anext__()]
+        feed.publish("table_data", "created", "other", user_id="u2")
+        feed.publish(None, "reset", None)
+        messages.append(await stream.__anext__())
+        await stream.aclose()
+        return messages
+
+    hello, reset = asyncio.run(scenario())
+
+    assert b"event: hello" in hello
+    assert reset.startswith(f"id: {feed.stream_id}:2\n".encode())
+    assert b"event: reset" in reset
@@ -0,0 +1,48 @@
+"""
+Near-duplicate screening against a store's LSH index
+"""
+
+from models.records import DatasetRecord
+from services.dedup import DedupIndexes
+from services.storage import RecordStore, ensure_json_array_file
+
+MESSAGE = "Hi, I would like to order forty bags of espresso beans for the cafe next week"
+RESPONSE = "We can offer a ten percent discount on orders above thirty bags"
+
+
+def make_indexes(tmp_path):
+    store = RecordStore(lambda: ensure_json_array_file(tmp_path / "table_data.json"), DatasetRecord)
+    return store, DedupIndexes(lambda user_id: store)
+
+
+def row(row_id, message=MESSAGE):
+    return {"id": row_id, "customer_message": message, "business_response": RESPONSE}
+
+
+def test_warm_indexes_existing_rows_in_the_background(tmp_path):
+    store, indexes = make_indexes(tmp_path)
+    store.add_many([row("a"), row("b", "Completely different question about delivery times")])
+
+    indexes.warm(["default"]).result(timeout=10)
+
+    assert len(indexes.index("default").index) == 2
+
+
+def test_flag_marks_near_duplicates_of_stored_rows(tmp_path):
+    store, indexes = make_indexes(tmp_path)
+    store.add_many([row("a")])
+
+    accepted, rejected = indexes.index("default").screen([row("b", MESSAGE + "!")], "flag")
+
+    assert rejected == []
+    assert accepted[0]["metadata"]["near_duplicate_of"] == "a"
+
+
+def test_reject_refuses_near_duplicates_within_one_batch(tmp_path):
+    _, indexes = make_indexes(tmp_path)
+
+    accepted, rejected = indexes.index("default").screen([row("a"), row("b")], "reject")
+
+    assert [r["id"] for r in accepted] == ["a"]
+    assert rejected[0]["id"] == "b"
+    assert rejected[0]["duplicates"][0]["id"] == "a"
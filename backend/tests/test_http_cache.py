@@ -0,0 +1,42 @@
+"""
+Validators and 304s for dataset responses
+"""
+
+from email.utils import formatdate
+
+from services.http_cache import _etag_matches, _not_modified_since, _validator_headers, make_etag
+
+SECOND = 1_000_000_000
+
+
+def test_if_modified_since_in_the_same_second_is_not_a_304():
+    mtime_ns = 1_700_000_000 * SECOND + 400_000_000
+    last_modified = formatdate(mtime_ns / SECOND, usegmt=True)
+
+    # A second write in the same second keeps the same Last-Modified date
+    assert not _not_modified_since(last_modified, mtime_ns + 300_000_000)
+
+
+def test_if_modified_since_after_the_mtime_is_a_304():
+    mtime_ns = 1_700_000_000 * SECOND
+    assert _not_modified_since(formatdate(1_700_000_001, usegmt=True), mtime_ns)
+    assert not _not_modified_since(formatdate(1_699_999_999, usegmt=True), mtime_ns)
+    assert not _not_modified_since("not a date", mtime_ns)
+
+
+def test_etag_changes_with_generation_and_matches_weakly():
+    etag = make_etag((1_700_000_000 * SECOND, 10, 1))
+
+    assert etag != make_etag((1_700_000_000 * SECOND, 10, 2))
+    assert _etag_matches(etag, etag)
+    assert _etag_matches(etag[2:], etag)
+    assert _etag_matches(f'"other", {etag}', etag)
+    assert _etag_matches("*", etag)
+    assert not _etag_matches('"other"', etag)
+
+
+def test_responses_vary_by_user():
+    vary = _validator_headers((1_700_000_000 * SECOND, 10, 1))["Vary"]
+
+    assert "X-User-Id" in vary
+    assert "Accept-Encoding" in vary
@@ -0,0 +1,93 @@
+"""
+Profiles captured by the profiling middleware
+"""
+
+import cProfile
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from services.profiler import ProfiledRoute, ProfileStore, ProfilingMiddleware
+
+
+def busy_work():
+    return sum(i * i for i in range(200_000))
+
+
+def make_client(tmp_path, route_class=None):
+    app = FastAPI()
+    if route_class is not None:
+        app.router.route_class = route_class
+
+    @app.get("/api/work")
+    async def work():
+        return {"total": busy_work()}
+
+    @app.get("/api/sync-work")
+    def sync_work():
+        return {"total": busy_work()}
+
+    store = ProfileStore(tmp_path)
+    app.add_middleware(ProfilingMiddleware, store=store)
+    return TestClient(app), store
+
+
+def test_only_requests_with_the_header_are_profiled(tmp_path):
+    client, store = make_client(tmp_path)
+
+    client.get("/api/work")
+    client.get("/api/work", headers={"X-Profile": "1"})
+
+    profiles = store.slowest()
+    assert len(profiles) == 1
+    assert profiles[0]["route"] == "/api/work"
+    assert profiles[0]["status_code"] == 200
+
+
+def test_top_functions_rank_own_time_over_framework_wrappers(tmp_path):
+    client, store = make_client(tmp_path)
+
+    client.get("/api/work", headers={"X-Profile": "1"})
+
+    top = store.slowest(top_functions=3)[0]["top_functions"]
+    assert "genexpr" in top[0]["function"]
+    assert top == sorted(top, key=lambda row: row["tottime_ms"], reverse=True)
+
+
+def save_capture(store, route="/api/work"):
+    profile = cProfile.Profile()
+    profile.enable()
+    busy_work()
+    profile.disable()
+    return store.save(profile, "GET", route, route, duration_ms=1.0, status_code=200)
+
+
+def test_captures_are_shared_and_capped_across_workers_and_restarts(tmp_path):
+    # Left over from an earlier run without a sidecar
+    (tmp_path / "20000101_000000_000000_GET_api_old.prof").write_bytes(b"")
+    first, second = ProfileStore(tmp_path, max_profiles=3), ProfileStore(tmp_path, max_profiles=3)
+
+    saved = [save_capture(store)["id"] for store in (first, second, first, second)]
+
+    assert [entry["id"] for entry in first.entries()] == saved[1:]
+    assert [entry["id"] for entry in ProfileStore(tmp_path).entries()] == saved[1:]
+    assert len(list(tmp_path.glob("*.prof"))) == 3
+
+
+def test_sync_endpoints_are_profiled_in_their_worker_thread(tmp_path):
+    client, store = make_client(tmp_path, route_class=ProfiledRoute)
+
+    client.get("/api/sync-work", headers={"X-Profile": "1"})
+
+    profile = store.slowest(top_functions=3)[0]
+    assert profile["note"] is None
+    # The event loop spends the same time waiting in its selector
+    assert any("genexpr" in row["function"] for row in profile["top_functions"])
+
+
+def test_unprofiled_threadpool_work_is_reported(tmp_path):
+    client, store = make_client(tmp_path)
+
+    client.get("/api/sync-work", headers={"X-Profile": "1"})
+
+    assert "threadpool" in store.slowest()[0]["note"]
@@ -0,0 +1,96 @@
+"""
+Compact records decoded from stored JSON
+"""
+
+import copy
+
+import pytest
+
+from models.records import (
+    MISSING, ConversationMetadata, ConversationRecord, DatasetRecord, MessageRecord,
+    TrainedModelRecord, decode_records,
+)
+
+CONVERSATION = {
+    "id": "c1",
+    "title": "Pricing question",
+    "messages": [
+        {"role": "user", "content": "How much?", "timestamp": "2024-01-01T00:00:00"},
+        {"role": "assistant", "content": "Ça coûte 40 €", "timestamp": "2024-01-01T00:00:05", "tokens": 7},
+    ],
+    "metadata": {
+        "intent": "pricing", "outcome": "sale", "final_price": 40.0,
+        "business_type": "bakery", "complexity": "low", "tags": ["price", "bread"],
+        "source": "import",
+    },
+    "created_at": "2024-01-01T00:00:00",
+    "is_favorite": False,
+    "archived": True,
+}
+
+
+def test_conversation_round_trips_unchanged():
+    record = ConversationRecord.from_dict(copy.deepcopy(CONVERSATION))
+
+    assert record.to_dict() == CONVERSATION
+
+
+def test_nested_messages_and_metadata_become_records():
+    record = ConversationRecord.from_dict(copy.deepcopy(CONVERSATION))
+
+    assert type(record.messages) is tuple
+    assert all(type(message) is MessageRecord for message in record.messages)
+    assert record.messages[1].extra == {"tokens": 7}
+    assert type(record.metadata) is ConversationMetadata
+    assert record.metadata.intent == "pricing"
+    assert record.metadata.extra == {"source": "import"}
+
+
+def test_tags_are_stored_as_a_tuple_and_encoded_as_a_list():
+    record = DatasetRecord.from_dict({"id": "d1", "tags": ["a", "b"]})
+
+    assert record.tags == ("a", "b")
+    assert record.to_dict()["tags"] == ["a", "b"]
+    assert type(record.to_dict()["tags"]) is list
+
+
+def test_absent_fields_are_missing_and_explicit_none_is_kept():
+    record = TrainedModelRecord.from_dict({"id": "m1", "loss": None})
+
+    assert record.accuracy is MISSING
+    assert record.loss is None
+    assert record.get("accuracy", 0.5) == 0.5
+    assert record.get("loss", 0.5) is None
+    assert record.to_dict() == {"id": "m1", "loss": None}
+
+
+def test_unknown_keys_are_kept_in_extra():
+    record = DatasetRecord.from_dict({"id": "d1", "customer_message": "hi", "score": 3})
+
+    assert record.extra == {"score": 3}
+    assert record.get("score") == 3
+    assert record.get("absent", "default") == "default"
+    assert record.to_dict() == {"id": "d1", "customer_message": "hi", "score": 3}
+
+
+def test_records_without_unknown_keys_have_no_extra():
+    assert TrainedModelRecord.from_dict({"id": "m1"}).extra is None
+
+
+def test_categorical_strings_are_interned():
+    first = DatasetRecord.from_dict({"intent": "".join(["pri", "cing"])})
+    second = DatasetRecord.from_dict({"intent": "".join(["pric", "ing"])})
+
+    assert first.intent is second.intent
+
+
+def test_records_compare_by_document():
+    assert ConversationRecord.from_dict(copy.deepcopy(CONVERSATION)) == \
+        ConversationRecord.from_dict(copy.deepcopy(CONVERSATION))
+    assert DatasetRecord.from_dict({"id": "a"}) != DatasetRecord.from_dict({"id": "b"})
+
+
+def test_decode_records_rejects_non_arrays():
+    assert [r.get("id") for r in decode_records(TrainedModelRecord, [{"id": "a"}, {"id": "b"}])] == ["a", "b"]
+    with pytest.raises(ValueError):
+        decode_records(TrainedModelRecord, {"id": "a"})
@@ -0,0 +1,112 @@
+"""
+JSON backends used for responses and dataset files
+
+Every backend must produce the same bytes: snapshots cut dataset files into
+chunks at record boundaries and rely on re-encoding being byte-exact.
+"""
+
+import dataclasses
+from datetime import date, datetime, timedelta, timezone
+from uuid import UUID
+
+import pytest
+from pydantic import BaseModel
+
+from services.serialization import _json_backend, _msgspec_backend, _orjson_backend
+
+DOCUMENTS = [
+    [],
+    {},
+    [{
+        "id": "c1",
+        "title": "Pricing question",
+        "messages": [
+            {"role": "user", "content": "Combien coûte le pain ? 🥖", "timestamp": "2024-01-01T00:00:00"},
+            {"role": "assistant", "content": "Цена — 40 € / 四十\n\"quoted\" \\ tab\t", "timestamp": None},
+        ],
+        "metadata": {"intent": "pricing", "final_price": 40.5, "tags": ["price", "bread"], "score": -3},
+        "is_favorite": False,
+    }],
+    {"headers": ["a", "b"], "entries": [[1, 2.25], [True, None]], "nested": {"empty": [], "zero": 0}},
+]
+
+
+@dataclasses.dataclass
+class Point:
+    x: int
+    label: str
+
+
+class Tag(BaseModel):
+    name: str
+    created: datetime
+
+
+SPECIAL = {
+    "datetime": datetime(2024, 1, 2, 3, 4, 5, 123456),
+    "utc": datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+    "offset": datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone(timedelta(hours=2))),
+    "date": date(2024, 1, 2),
+    "uuid": UUID("12345678-1234-5678-1234-567812345678"),
+    "dataclass": Point(1, "ünïcode"),
+    "model": Tag(name="sale", created=datetime(2024, 1, 2)),
+}
+
+SPECIAL_DECODED = {
+    "datetime": "2024-01-02T03:04:05.123456",
+    "utc": "2024-01-02T03:04:05Z",
+    "offset": "2024-01-02T03:04:05+02:00",
+    "date": "2024-01-02",
+    "uuid": "12345678-1234-5678-1234-567812345678",
+    "dataclass": {"x": 1, "label": "ünïcode"},
+    "model": {"name": "sale", "created": "2024-01-02T00:00:00"},
+}
+
+
+def load_backend(factory):
+    try:
+        return factory()
+    except ImportError as e:
+        pytest.skip(f"{e.name} is not installed")
+
+
+@pytest.fixture(params=[_orjson_backend, _msgspec_backend, _json_backend],
+                ids=["orjson", "msgspec", "json"])
+def backend(request):
+    return load_backend(request.param)
+
+
+@pytest.mark.parametrize("document", DOCUMENTS + [SPECIAL])
+def test_backends_produce_the_same_bytes(backend, document):
+    _, reference_dumps, _ = _json_backend()
+    _, dumps, _ = backend
+
+    assert dumps(document) == reference_dumps(document)
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_documents_round_trip(backend, document):
+    _, dumps, loads = backend
+    body = dumps(document)
+
+    assert loads(body) == document
+    assert dumps(loads(body)) == body
+
+
+def test_default_types_are_encoded(backend):
+    _, dumps, loads = backend
+
+    assert loads(dumps(SPECIAL)) == SPECIAL_DECODED
+
+
+def test_non_ascii_text_is_written_as_utf8(backend):
+    _, dumps, _ = backend
+
+    assert dumps({"text": "coûte 🥖"}) == '{"text":"coûte 🥖"}'.encode("utf-8")
+
+
+def test_unknown_types_are_rejected(backend):
+    _, dumps, _ = backend
+
+    with pytest.raises(TypeError):
+        dumps({"value": object()})
@@ -0,0 +1,85 @@
+"""
+Per-user dataset shards
+"""
+
+import threading
+import time
+
+from models.records import ConversationRecord
+from services.sharding import DEFAULT_USER, ShardedStore
+
+
+def make_store(tmp_path, **kwargs):
+    return ShardedStore(lambda: tmp_path, {"conversations": ("conversations.json", ConversationRecord)}, **kwargs)
+
+
+def test_users_read_and_write_only_their_own_shard(tmp_path):
+    store = make_store(tmp_path)
+
+    store.store("alice", "conversations").add({"id": "a", "title": "alice"})
+    store.store("bob", "conversations").add({"id": "b", "title": "bob"})
+
+    assert [r.get("id") for r in store.store("alice", "conversations").records()] == ["a"]
+    assert store.store(DEFAULT_USER, "conversations").records() == []
+    assert store.users() == [DEFAULT_USER, "alice", "bob"]
+
+
+def test_migration_moves_user_records_out_of_the_default_shard(tmp_path):
+    store = make_store(tmp_path, max_open_shards=2)
+    default = store.store(DEFAULT_USER, "conversations")
+    default.add_many([
+        {"id": "1", "user_id": "alice"},
+        {"id": "2", "user_id": "bob"},
+        {"id": "3", "user_id": "carol"},
+        {"id": "4"},
+    ])
+
+    assert store.migrate_default_shard() == {"conversations": 3}
+    assert [r.get("id") for r in default.records()] == ["4"]
+    for user_id, record_id in (("alice", "1"), ("bob", "2"), ("carol", "3")):
+        assert [r.get("id") for r in store.store(user_id, "conversations").records()] == [record_id]
+
+
+def test_updates_racing_the_migration_are_not_silently_lost(tmp_path):
+    store = make_store(tmp_path)
+    default = store.store(DEFAULT_USER, "conversations")
+    default.add({"id": "1", "user_id": "alice", "title": "old"})
+
+    alice = store.store("alice", "conversations")
+    original_add_many = alice.add_many
+    results = []
+
+    def add_many_with_racing_update(documents):
+        # Update the record in the default shard between the copy and the delete
+        updater = threading.Thread(target=lambda: results.append(
+            default.replace("1", {"id": "1", "user_id": "alice", "title": "new"})))
+        updater.start()
+        updater.join(timeout=0.2)
+        return original_add_many(documents)
+
+    alice.add_many = add_many_with_racing_update
+    store.migrate_default_shard()
+    while not results:
+        time.sleep(0.01)
+
+    # The update waited for the migration and found the record gone, rather
+    # than succeeding on a copy that was then deleted
+    assert results == [None]
+    assert [r.get("title") for r in alice.records()] == ["old"]
+    assert default.records() == []
+
+
+def test_reads_do_not_create_shards(tmp_path):
+    store = make_store(tmp_path)
+
+    bob = store.store("bob", "conversations")
+
+    assert bob.records() == []
+    assert bob.encoded() == b"[]"
+    assert store.users() == [DEFAULT_USER]
+    assert not (tmp_path / "users").exists()
+
+    bob.add({"id": "1"})
+
+    assert store.users() == [DEFAULT_USER, "bob"]
+    assert [r.get("id") for r in bob.records()] == ["1"]
@@ -0,0 +1,42 @@
+"""
+Batch negotiation simulator writing into a record store
+"""
+
+import asyncio
+
+import pytest
+
+from models.records import DatasetRecord
+from services.simulator import NegotiationSimulator, StubModel, scenario_grid
+from services.storage import RecordStore, ensure_json_array_file
+
+
+def make_store(tmp_path):
+    return RecordStore(lambda: ensure_json_array_file(tmp_path / "table_data.json"), DatasetRecord)
+
+
+def test_dialogues_are_written_in_batches(tmp_path):
+    store = make_store(tmp_path)
+    simulator = NegotiationSimulator(StubModel(), store, turns=2, concurrency=4, batch_size=10)
+    scenarios = scenario_grid(["retail"], ["discount_request"], ["bulk order"])
+
+    report = asyncio.run(simulator.run(scenarios, per_scenario=6))
+
+    assert report.dialogues == 6
+    assert report.failed_dialogues == 0
+    assert len(store.records()) == report.rows >= 6
+
+
+def test_failed_write_stops_the_run_instead_of_hanging(tmp_path):
+    class BrokenStore:
+        def add_many(self, documents):
+            raise OSError("disk full")
+
+    simulator = NegotiationSimulator(StubModel(), BrokenStore(), turns=1, concurrency=2, batch_size=1)
+    scenarios = scenario_grid(["retail"], ["discount_request"], ["bulk order"])
+
+    async def scenario():
+        return await asyncio.wait_for(simulator.run(scenarios, per_scenario=50), timeout=5)
+
+    with pytest.raises(OSError, match="disk full"):
+        asyncio.run(scenario())
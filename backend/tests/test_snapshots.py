@@ -0,0 +1,77 @@
+"""
+Incremental snapshots of the datasets directory
+"""
+
+import asyncio
+
+from models.records import ConversationRecord
+from services.change_feed import ChangeFeed, ChangeLog
+from services.sharding import ShardedStore
+from services.snapshots import SnapshotRepository
+from services.storage import RecordStore, ensure_json_array_file
+
+
+def make_repository(tmp_path, **kwargs):
+    datasets = tmp_path / "datasets"
+    datasets.mkdir()
+    store = RecordStore(lambda: ensure_json_array_file(datasets / "conversations.json"), ConversationRecord)
+    return store, SnapshotRepository(lambda: tmp_path / "snapshots", lambda: datasets, **kwargs)
+
+
+def test_restore_in_place_brings_back_the_snapshot(tmp_path):
+    store, repository = make_repository(tmp_path)
+    store.add_many([{"id": str(i), "title": f"conversation {i}"} for i in range(50)])
+    snapshot = repository.create()
+
+    store.delete("7")
+    store.replace("8", {"id": "8", "title": "changed"})
+    second = repository.create()
+    repository.restore(snapshot["id"])
+
+    assert second["unchanged_files"] == 0
+    assert len(store.records()) == 50
+    assert store.records()[8].get("title") == "conversation 8"
+
+
+def test_restore_in_place_keeps_users_registered_after_the_snapshot(tmp_path):
+    datasets = tmp_path / "datasets"
+    datasets.mkdir()
+    sharded = ShardedStore(lambda: datasets, {"conversations": ("conversations.json", ConversationRecord)})
+    repository = SnapshotRepository(lambda: tmp_path / "snapshots", lambda: datasets)
+    sharded.store("alice", "conversations").add({"id": "a"})
+    snapshot = repository.create()
+
+    sharded.store("bob", "conversations").add({"id": "b"})
+    result = repository.restore(snapshot["id"])
+
+    assert sharded.users()[1:] == ["alice", "bob"]
+    assert [r.get("id") for r in sharded.store("bob", "conversations").records()] == ["b"]
+    assert any(name.endswith("conversations.json") for name in result["not_in_snapshot"])
+
+
+def test_unchanged_files_are_not_read_again(tmp_path):
+    store, repository = make_repository(tmp_path)
+    store.add({"id": "1"})
+    repository.create()
+
+    assert repository.create()["changed_files"] == 0
+
+
+def test_restore_in_place_resets_change_feed_subscribers(tmp_path):
+    feed = ChangeFeed(log=ChangeLog(lambda: tmp_path / "datasets" / "changes.log"))
+    store, repository = make_repository(
+        tmp_path, on_restore=lambda snapshot_id: feed.publish(None, "reset", None),
+    )
+    store.add({"id": "1"})
+    snapshot = repository.create()
+
+    repository.restore(snapshot["id"], target_dir=tmp_path / "copy")
+    repository.restore(snapshot["id"])
+
+    async def backlog():
+        subscription, events, _ = feed.subscribe(since=0)
+        feed.unsubscribe(subscription)
+        return [event["action"] for event in events]
+
+    # Only the restore over the live directory resets subscribers
+    assert asyncio.run(backlog()) == ["reset"]
@@ -0,0 +1,20 @@
+"""
+Cold start of ``import main`` stays within the time and memory budget
+"""
+
+import pytest
+
+from benchmarks.bench_startup import budget_failures, measure
+
+pytest.importorskip("resource", reason="RSS is measured with the Unix resource module")
+
+# Looser than the benchmark defaults so a busy CI machine does not flake
+MAX_SECONDS = 3.0
+MAX_RSS_MB = 150.0
+
+
+def test_cold_start_is_within_budget():
+    result = measure(runs=3)
+
+    assert budget_failures(result, max_seconds=MAX_SECONDS, max_rss_mb=MAX_RSS_MB) == []
+
@@ -0,0 +1,20 @@
+"""
+Acknowledged writes survive several uvicorn workers sharing one datasets directory
+"""
+
+import pytest
+
+from benchmarks.bench_workers import run_load
+
+fcntl = pytest.importorskip("fcntl", reason="cross-process locking needs fcntl")
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_concurrent_writes_are_stored_exactly_once(workers):
+    result = run_load(workers=workers, clients=6, requests=10)
+
+    assert result["lost"] == []
+    assert result["duplicated"] == []
+    assert result["resurrected"] == []
+    assert result["stale"] == []
+    assert result["stored"] == result["expected"]